@@ -0,0 +1,252 @@
+"""
+Cross-department batched Gemini summaries.
+
+Departments whose summaries are pending at the same time share one Gemini
+request: the instructions and headings are sent once, followed by each
+department's statistics, and a JSON response schema makes Gemini answer with
+one object per department that is split back into its Summary sheet text.
+Batches are sized to the model's context and output limits, and a reply that
+can't be used falls back to one call per department.
+"""
+
+from ai_insights import (
+    AI_DISABLED_MESSAGE,
+    AI_ERROR_MESSAGE,
+    AI_FALLBACK_MESSAGE,
+    ANALYSIS_REQUEST,
+    ai_executor,
+    build_ai_prompt,
+    build_instructions,
+    build_stats_block,
+    cached_summary,
+    clean_ai_text,
+    gemini_url,
+    read_gemini_reply,
+    request_summary,
+    store_summary,
+    with_local_summary,
+)
+from gemini_client import GeminiUnavailable, gemini_client
+from ranking import TOP_PAGES
+from concurrent.futures import Future
+from dotenv import load_dotenv
+import json
+import os
+import threading
+
+# Load environment variables
+load_dotenv()
+
+# Departments per batched request; 0 or 1 sends one request per department
+AI_BATCH_SIZE = int(os.getenv('AI_BATCH_SIZE', '0'))
+# Model input and output limits in tokens, and the output budgeted for each department's summary
+AI_CONTEXT_TOKENS = int(os.getenv('AI_CONTEXT_TOKENS', '1048576'))
+AI_OUTPUT_TOKENS = int(os.getenv('AI_OUTPUT_TOKENS', '65536'))
+AI_SUMMARY_TOKENS = int(os.getenv('AI_SUMMARY_TOKENS', '2048'))
+
+# Rough size of a token in English prompt text
+CHARS_PER_TOKEN = 4
+
+SECTION_FIELDS = [
+    ("whats_working", "WHAT'S WORKING"),
+    ("whats_not_working", "WHAT'S NOT WORKING"),
+    ("recommendations", "RECOMMENDATIONS"),
+]
+
+BATCH_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "department": {"type": "STRING"},
+            **{field: {"type": "STRING"} for field, _ in SECTION_FIELDS},
+        },
+        "required": ["department"] + [field for field, _ in SECTION_FIELDS],
+    },
+}
+
+BATCH_REPLY_FORMAT = (
+    "\nAnalyze each department separately. Reply with a JSON array holding one object per department: "
+    "its id in \"department\" and the text under each heading in \"whats_working\", "
+    "\"whats_not_working\" and \"recommendations\"."
+)
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def build_batch_prompt(blocks, top_pages=TOP_PAGES):
+    """One prompt for several departments' (id, stats block) pairs"""
+    formatted_summary = (
+        f"{build_instructions(top_pages)}\n"
+        f"The statistics below cover {len(blocks)} departments, each introduced by a DEPARTMENT line with its id.\n\n"
+    )
+    for department_id, block in blocks:
+        formatted_summary += f"DEPARTMENT {department_id}:\n{block}\n"
+    return clean_ai_text(formatted_summary) + ANALYSIS_REQUEST + BATCH_REPLY_FORMAT
+
+def batch_payload(prompt):
+    return {
+        "contents": [
+            {"parts": [{"text": prompt}]}
+        ],
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": BATCH_RESPONSE_SCHEMA,
+        },
+    }
+
+def parse_batch_reply(text, ids):
+    """Summary text per department id from a batched JSON reply, raising ValueError if one is missing"""
+    summaries = {}
+    for entry in json.loads(text):
+        if not isinstance(entry, dict) or entry.get("department") not in ids:
+            continue
+        if not all(isinstance(entry.get(field), str) for field, _ in SECTION_FIELDS):
+            continue
+        summaries[entry["department"]] = clean_ai_text(
+            "\n\n".join(f"{heading}\n{entry[field].strip()}" for field, heading in SECTION_FIELDS)
+        )
+    missing = [department_id for department_id in ids if department_id not in summaries]
+    if missing:
+        raise ValueError(f"no usable summary for {', '.join(missing)}")
+    return summaries
+
+class PendingSummary(Future):
+    """Future of a batched summary; waiting for it sends the batch it is still queued in"""
+
+    def __init__(self, batcher, prompt, block, top_pages, data):
+        super().__init__()
+        self.batcher = batcher
+        self.prompt = prompt
+        self.block = block
+        self.top_pages = top_pages
+        # (grouped_data, section_traffic_percentage, overall_stats) for the local fallback summary
+        self.data = data
+        self.tokens = estimate_tokens(block)
+
+    def fall_back(self, note):
+        """Resolve with the locally generated summary, headed by note"""
+        self.set_result(with_local_summary(note, *self.data))
+
+    def result(self, timeout=None):
+        if not self.done():
+            self.batcher.flush(self)
+        return super().result(timeout)
+
+class SummaryBatcher:
+    """Drop-in for get_ai_insights that groups departments' Gemini calls into shared requests.
+
+    A batch is sent when it is full (batch_size departments or the token
+    limits), when all expected departments have been started, or as soon as
+    one of its summaries is waited for, so a sequential run never stalls.
+    """
+
+    def __init__(self, expected=None, batch_size=AI_BATCH_SIZE, deadline=None):
+        self.expected = expected
+        self.batch_size = batch_size
+        self.deadline = deadline
+        self.started = 0
+        self._pending = []
+        self._pending_tokens = 0
+        self._base_tokens = estimate_tokens(build_instructions() + ANALYSIS_REQUEST + BATCH_REPLY_FORMAT)
+        self._lock = threading.Lock()
+
+    def __call__(self, grouped_data, section_traffic_percentage, overall_stats):
+        return self.start(grouped_data, section_traffic_percentage, overall_stats).result()
+
+    def start(self, grouped_data, section_traffic_percentage, overall_stats):
+        """Queue a department's summary and return its Future"""
+        prompt = build_ai_prompt(section_traffic_percentage, overall_stats)
+        future = PendingSummary(self, prompt, build_stats_block(section_traffic_percentage, overall_stats),
+                                overall_stats.get("top_pages", TOP_PAGES),
+                                (grouped_data, section_traffic_percentage, overall_stats))
+
+        api_key = os.getenv('GEMINI_API_KEY')
+        if not api_key:
+            print("Warning: GEMINI_API_KEY not found in environment variables. AI insights will be generated locally.")
+            future.fall_back(AI_DISABLED_MESSAGE)
+        else:
+            summary = cached_summary(api_key, prompt)
+            if summary is not None:
+                future.set_result(summary)
+
+        ready = []
+        with self._lock:
+            self.started += 1
+            if not future.done():
+                if self._pending and not self._fits(future):
+                    ready.append(self._take())
+                self._pending.append(future)
+                self._pending_tokens += future.tokens
+            if self._pending and (len(self._pending) >= self.batch_size or self.started == self.expected):
+                ready.append(self._take())
+        for batch in ready:
+            ai_executor.submit(self._send, batch)
+        return future
+
+    def _fits(self, future):
+        """Whether future can join the pending batch within the size and token limits"""
+        count = len(self._pending) + 1
+        input_tokens = self._base_tokens + self._pending_tokens + future.tokens
+        output_tokens = count * AI_SUMMARY_TOKENS
+        return (count <= self.batch_size and output_tokens <= AI_OUTPUT_TOKENS
+                and input_tokens + output_tokens <= AI_CONTEXT_TOKENS)
+
+    def _take(self):
+        batch, self._pending, self._pending_tokens = self._pending, [], 0
+        return batch
+
+    def flush(self, future=None):
+        """Send the pending batch now, or do nothing if future has already been sent"""
+        with self._lock:
+            if future is not None and future not in self._pending:
+                return
+            batch = self._take()
+        if batch:
+            self._send(batch)
+
+    def _send(self, batch):
+        try:
+            self._send_batch(batch)
+        except Exception as e:
+            for future in batch:
+                if not future.done():
+                    future.fall_back(AI_ERROR_MESSAGE.format("Error retrieving Gemini suggestions: " + str(e)))
+
+    def _send_single(self, future):
+        summary, ok = request_summary(os.getenv('GEMINI_API_KEY'), future.prompt, self.deadline)
+        if ok:
+            future.set_result(summary)
+        else:
+            future.fall_back(summary)
+
+    def _send_batch(self, batch):
+        if len(batch) == 1:
+            self._send_single(batch[0])
+            return
+
+        ids = [f"D{number}" for number in range(1, len(batch) + 1)]
+        prompt = build_batch_prompt([(department_id, future.block) for department_id, future in zip(ids, batch)],
+                                    batch[0].top_pages)
+        try:
+            response = gemini_client.post(gemini_url(os.getenv('GEMINI_API_KEY')), batch_payload(prompt), self.deadline)
+            reply, ok = read_gemini_reply(response)
+            summaries = parse_batch_reply(reply, ids) if ok else None
+        except GeminiUnavailable as e:
+            print(f"Skipping Gemini: {e}")
+            for future in batch:
+                future.fall_back(AI_FALLBACK_MESSAGE)
+            return
+        except Exception as e:
+            print(f"Batched Gemini reply for {len(batch)} departments could not be used: {e}")
+            summaries = None
+
+        if summaries is None:
+            # Fall back to one call per department
+            for future in batch:
+                ai_executor.submit(self._send, [future])
+            return
+
+        for department_id, future in zip(ids, batch):
+            store_summary(future.prompt, summaries[department_id])
+            future.set_result(summaries[department_id])
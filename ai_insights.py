@@ -0,0 +1,260 @@
+"""
+Gemini-generated Summary sheet text shared by the web app and the batch script.
+
+When Gemini can't be used (no API key, open circuit breaker, failed call) the
+summary is generated locally by local_summary instead, headed by a note on why.
+"""
+
+from ranking import SUMMARY_PAGES, TOP_PAGES
+from response_cache import DEFAULT_CACHE_DIR, ResponseCache, fingerprint
+from gemini_client import GeminiUnavailable, gemini_client
+from local_summary import local_summary
+from excel_writer import DeferredSheet
+from concurrent.futures import Future, ThreadPoolExecutor
+from dotenv import load_dotenv
+import json
+import os
+import re
+import threading
+import pandas as pd
+
+# Load environment variables
+load_dotenv()
+
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
+
+# Summary generator used when a run doesn't pick one: Gemini, or the offline local_summary
+SUMMARY_ENGINES = ("gemini", "local")
+SUMMARY_ENGINE = os.getenv('SUMMARY_ENGINE', 'gemini').lower()
+
+# Notes heading a locally generated summary that stands in for Gemini's
+AI_DISABLED_MESSAGE = "AI insights disabled: GEMINI_API_KEY not configured, so this summary was generated locally from the report data. Set the GEMINI_API_KEY environment variable for AI insights."
+AI_FALLBACK_MESSAGE = "AI insights unavailable: Gemini is not responding right now, so this summary was generated locally from the report data. Run the report again later for AI insights."
+AI_ERROR_MESSAGE = "AI insights unavailable ({}), so this summary was generated locally from the report data."
+
+# Content-addressed cache of successful summaries, keyed by model and prompt
+AI_CACHE_DIR = os.getenv('AI_CACHE_DIR') or os.getenv('GA_CACHE_DIR') or DEFAULT_CACHE_DIR
+ai_summary_cache = ResponseCache(
+    os.path.join(AI_CACHE_DIR, 'ai_summaries.sqlite3'),
+    ttl=int(os.getenv('AI_CACHE_TTL', '604800')),
+    max_bytes=int(os.getenv('AI_CACHE_MAX_MB', '16')) * 1024 * 1024,
+    stale_ttl=int(os.getenv('AI_CACHE_STALE_TTL', '0')),
+)
+
+# Threads that run AI summaries while the data sheets are being rendered
+AI_WORKERS = int(os.getenv('AI_WORKERS', '8'))
+ai_executor = ThreadPoolExecutor(max_workers=AI_WORKERS, thread_name_prefix="ai-insights")
+
+# Prompts whose stale summary is being refreshed in the background
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+def clean_ai_text(text):
+    """Strip markdown bold and heading markers"""
+    text = text.replace("**", "")
+    return re.sub(r"#+\s*", "", text)
+
+ANALYSIS_REQUEST = (
+    "\nBased on this data, provide a very specific summary of what is working well and what is not, "
+    "included any key trends or issues. Make your analysis and recommendations by using BOTH the page titles and all available analytics fields: views, users, bounce rate, event count, views per user, and engagement time per view (in seconds). "
+    "For each observation, clearly explain WHY you think a particular type of content or topic is performing well or underperforming, making logical inferences from both the title and the analytics. "
+    "The recommendations need to be meaningful and actionable for people with varying degrees of website knowledge and front end development skill. "
+    "Do not make row-by-row suggestions. Instead, group your analysis and recommendations by content themes, patterns, or page types (not individual pages). "
+    "Structure your response under these headings:\n"
+    "WHAT'S WORKING\n"
+    "WHAT'S NOT WORKING\n"
+    "RECOMMENDATIONS\n"
+    "Make your analysis as specific and actionable as possible based only on the titles and analytics provided."
+)
+
+def build_instructions(top_pages=TOP_PAGES):
+    """Description of the report tabs that precedes the statistics"""
+    return (
+        "INSTRUCTIONS:\n"
+        f"- 'Top {top_pages} Pages' tab: Most visited pages in this department.\n"
+        "- 'Pages to Review' tab: Pages with low or poor engagement; consider reviewing for updates, consolidation, or removal.\n"
+        "- 'All Pages' tab: Full analytics for every tracked page in this department.\n"
+        "- 'Summary' tab: Automated high-level advice for improving your section.\n"
+    )
+
+def build_stats_block(section_traffic_percentage, overall_stats):
+    """One department's traffic share, summary statistics and top/bottom pages"""
+    block = (
+        f"SECTION TRAFFIC PERCENTAGE:\n"
+        f"- This department/section accounts for {section_traffic_percentage}% of all tracked site traffic.\n\n"
+        f"SUMMARY STATISTICS:\n"
+        f"- Total pages: {overall_stats['total_pages']}\n"
+        f"- Total views: {overall_stats['total_views']}\n"
+        f"- Average views per page: {overall_stats['average_views']:.2f}\n"
+        f"- Average users per page: {overall_stats['average_users']:.2f}\n"
+        f"- Average engagement time per view (sec): {overall_stats['average_engagement_time_per_view']:.2f}\n"
+        f"- Average bounce rate: {overall_stats['average_bounce_rate']:.2f}%\n"
+        f"- Pages with high bounce rate (>80%): {overall_stats['pages_with_high_bounce']}\n"
+        f"- Pages with low views (<10): {overall_stats['pages_with_low_views']}\n\n"
+        f"Top {SUMMARY_PAGES} most viewed pages:\n"
+    )
+    for page in overall_stats["top_5_pages"]:
+        block += f"    - {page['Page Title']} ({page['Views']} views)\n"
+    block += f"Bottom {SUMMARY_PAGES} least viewed pages:\n"
+    for page in overall_stats["bottom_5_pages"]:
+        block += f"    - {page['Page Title']} ({page['Views']} views)\n"
+    return block
+
+def build_ai_prompt(section_traffic_percentage, overall_stats):
+    """Build the Gemini prompt from a department's summary statistics"""
+    instructions = build_instructions(overall_stats.get("top_pages", TOP_PAGES))
+    formatted_summary = f"{instructions}\n" + build_stats_block(section_traffic_percentage, overall_stats)
+
+    # Clean up formatting
+    formatted_summary = clean_ai_text(formatted_summary)
+
+    return formatted_summary + ANALYSIS_REQUEST
+
+def get_summary_engine(name=None):
+    """Validated summary engine name, raising ValueError if it is unknown"""
+    name = (name or SUMMARY_ENGINE).lower()
+    if name not in SUMMARY_ENGINES:
+        raise ValueError(f"Unknown summary engine '{name}', expected one of: {', '.join(SUMMARY_ENGINES)}")
+    return name
+
+def with_local_summary(note, grouped_data, section_traffic_percentage, overall_stats):
+    """Locally generated summary headed by note on why Gemini's isn't used"""
+    return note + "\n\n" + local_summary(grouped_data, section_traffic_percentage, overall_stats)
+
+def gemini_url(api_key):
+    return f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={api_key}"
+
+def gemini_payload(prompt):
+    return {
+        "contents": [
+            {"parts": [{"text": prompt}]}
+        ]
+    }
+
+def read_gemini_reply(response):
+    """Extract the reply text from a requests or httpx response, and whether it is a real summary"""
+    if response.status_code == 200:
+        res_json = response.json()
+        try:
+            return res_json["candidates"][0]["content"]["parts"][0]["text"], True
+        except Exception as nested_e:
+            print("Could not extract text from Gemini API:", nested_e)
+            return "Failed to parse Gemini API output.", False
+    print("Gemini API error:", response.status_code, response.text)
+    return "API error: " + str(response.status_code), False
+
+def summary_cache_key(prompt, model=GEMINI_MODEL):
+    return fingerprint(json.dumps([model, prompt]).encode("utf-8"))
+
+def store_summary(prompt, summary):
+    ai_summary_cache.set(summary_cache_key(prompt), summary.encode("utf-8"))
+
+def finish_summary(prompt, gemini_reply, ok):
+    """Cleaned summary and whether it is one, caching it if so; failures become an AI_ERROR_MESSAGE note"""
+    if not ok:
+        return AI_ERROR_MESSAGE.format(gemini_reply.rstrip(".")), False
+
+    # Clean up Gemini output
+    summary = clean_ai_text(gemini_reply)
+    store_summary(prompt, summary)
+    return summary, True
+
+def request_summary(api_key, prompt, deadline=None):
+    """Ask Gemini for the summary of prompt; returns (summary, True), or (note on the failure, False)"""
+    try:
+        response = gemini_client.post(gemini_url(api_key), gemini_payload(prompt), deadline)
+        gemini_reply, ok = read_gemini_reply(response)
+    except GeminiUnavailable as e:
+        print(f"Skipping Gemini: {e}")
+        return AI_FALLBACK_MESSAGE, False
+    except Exception as e:
+        gemini_reply, ok = "Error retrieving Gemini suggestions: " + str(e), False
+    return finish_summary(prompt, gemini_reply, ok)
+
+def revalidate_summary(api_key, prompt):
+    """Refresh a stale cached summary in a background thread, once per prompt at a time"""
+    key = summary_cache_key(prompt)
+    with _revalidating_lock:
+        if key in _revalidating:
+            return
+        _revalidating.add(key)
+
+    def refresh():
+        try:
+            request_summary(api_key, prompt)
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(key)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+def cached_summary(api_key, prompt):
+    """Cached summary for a byte-identical prompt, or None.
+
+    A stale entry (see AI_CACHE_STALE_TTL) is returned as is and refreshed in
+    the background for the next run.
+    """
+    entry = ai_summary_cache.lookup(summary_cache_key(prompt))
+    if entry is None:
+        return None
+    summary, fresh = entry
+    if not fresh:
+        revalidate_summary(api_key, prompt)
+    return summary.decode("utf-8")
+
+def get_ai_insights(grouped_data, section_traffic_percentage, overall_stats, deadline=None):
+    """Get AI-generated insights using Gemini API, giving up at the time.monotonic() deadline"""
+    prompt = build_ai_prompt(section_traffic_percentage, overall_stats)
+
+    api_key = os.getenv('GEMINI_API_KEY')
+    if not api_key:
+        print("Warning: GEMINI_API_KEY not found in environment variables. AI insights will be generated locally.")
+        return with_local_summary(AI_DISABLED_MESSAGE, grouped_data, section_traffic_percentage, overall_stats)
+
+    summary = cached_summary(api_key, prompt)
+    if summary is not None:
+        return summary
+    summary, ok = request_summary(api_key, prompt, deadline)
+    return summary if ok else with_local_summary(summary, grouped_data, section_traffic_percentage, overall_stats)
+
+async def get_ai_insights_async(grouped_data, section_traffic_percentage, overall_stats, http_client, deadline=None):
+    """Get AI-generated insights using Gemini API through an httpx.AsyncClient"""
+    prompt = build_ai_prompt(section_traffic_percentage, overall_stats)
+
+    api_key = os.getenv('GEMINI_API_KEY')
+    if not api_key:
+        print("Warning: GEMINI_API_KEY not found in environment variables. AI insights will be generated locally.")
+        return with_local_summary(AI_DISABLED_MESSAGE, grouped_data, section_traffic_percentage, overall_stats)
+
+    summary = cached_summary(api_key, prompt)
+    if summary is not None:
+        return summary
+
+    try:
+        response = await gemini_client.post_async(http_client, gemini_url(api_key), gemini_payload(prompt), deadline)
+        summary, ok = finish_summary(prompt, *read_gemini_reply(response))
+    except GeminiUnavailable as e:
+        print(f"Skipping Gemini: {e}")
+        summary, ok = AI_FALLBACK_MESSAGE, False
+    except Exception as e:
+        summary, ok = finish_summary(prompt, "Error retrieving Gemini suggestions: " + str(e), False)
+    return summary if ok else with_local_summary(summary, grouped_data, section_traffic_percentage, overall_stats)
+
+def start_ai_insights(ai_insights, grouped_data, section_traffic_percentage, overall_stats):
+    """Start ai_insights in a background thread and return a Future of the summary text.
+
+    Objects with their own start() method, like ai_batch.SummaryBatcher, hand
+    out the Future themselves.
+    """
+    if hasattr(ai_insights, "start"):
+        return ai_insights.start(grouped_data, section_traffic_percentage, overall_stats)
+    return ai_executor.submit(ai_insights, grouped_data, section_traffic_percentage, overall_stats)
+
+def summary_frame(summary):
+    return pd.DataFrame([{"Summary": summary}])
+
+def summary_sheet(ai_summary):
+    """Summary sheet for a summary string, or a DeferredSheet for a Future from start_ai_insights"""
+    if isinstance(ai_summary, Future):
+        return DeferredSheet(ai_summary, summary_frame)
+    return summary_frame(ai_summary)
@@ -0,0 +1,85 @@
+"""
+Asyncio execution path that processes a batch of departments concurrently.
+
+GA reports are fetched with BetaAnalyticsDataAsyncClient and Gemini is called
+through httpx on the event loop, while the pandas and Excel work for each
+department runs in a worker thread. Summaries still being generated when a
+department hands its report to a render pool are waited for before the
+event loop and its HTTP client are closed.
+"""
+
+from google.analytics.data_v1beta import BetaAnalyticsDataAsyncClient
+from ai_insights import get_ai_insights_async
+from ga_reports import fetch_analytics_data_async, fetch_total_site_views_async
+import asyncio
+import httpx
+from dotenv import load_dotenv
+import os
+
+# Load environment variables
+load_dotenv()
+
+# Departments processed at the same time
+DEPARTMENT_CONCURRENCY = int(os.getenv('DEPARTMENT_CONCURRENCY', '4'))
+
+class LoopSummaries:
+    """ai_insights that call Gemini through http_client on the event loop, for departments run in worker threads"""
+
+    def __init__(self, loop, http_client, deadline=None):
+        self.loop = loop
+        self.http_client = http_client
+        self.deadline = deadline
+        self.started = []
+
+    def __call__(self, grouped_data, section_traffic_percentage, overall_stats):
+        return self.start(grouped_data, section_traffic_percentage, overall_stats).result()
+
+    def start(self, grouped_data, section_traffic_percentage, overall_stats):
+        """Schedule a department's summary on the loop and return its Future"""
+        coro = get_ai_insights_async(grouped_data, section_traffic_percentage, overall_stats, self.http_client, self.deadline)
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        self.started.append(future)
+        return future
+
+    async def wait(self):
+        """Wait for every summary started so far"""
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in self.started), return_exceptions=True)
+
+async def process_departments_async(urls, dept_paths, process_department, credentials, start_date, end_date,
+                                    property_id, dept_rows=None, total_site_views=None,
+                                    concurrency=DEPARTMENT_CONCURRENCY, deadline=None):
+    """Run process_department for every URL concurrently and return the results in URL order.
+
+    process_department(url, rows, total_site_views, ai_insights) is called in a
+    worker thread. If an async fetch fails it receives rows=None and fetches
+    synchronously, so errors are reported the same way as the sequential path.
+    Gemini calls give up at the time.monotonic() deadline, if one is given.
+    Summaries a department started are finished before this returns, even if
+    its report only waits for them later in a render pool.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with BetaAnalyticsDataAsyncClient(credentials=credentials) as client, httpx.AsyncClient() as http_client:
+        ai_insights = LoopSummaries(loop, http_client, deadline)
+
+        if total_site_views is None:
+            try:
+                total_site_views = await fetch_total_site_views_async(client, start_date, end_date, property_id)
+            except Exception as e:
+                print(f"Async site total request failed, departments will fetch it themselves: {e}")
+
+        async def run_department(url, dept_path):
+            async with semaphore:
+                rows = dept_rows[dept_path] if dept_rows is not None else None
+                if rows is None:
+                    try:
+                        rows = await fetch_analytics_data_async(client, dept_path, start_date, end_date, property_id)
+                    except Exception as e:
+                        print(f"Async fetch failed for {url}, retrying synchronously: {e}")
+                return await asyncio.to_thread(process_department, url, rows, total_site_views, ai_insights)
+
+        results = await asyncio.gather(*(run_department(url, dept_path) for url, dept_path in zip(urls, dept_paths)))
+        # Leaving the block closes http_client, so summaries still running for the render pool finish first
+        await ai_insights.wait()
+        return results
@@ -0,0 +1,70 @@
+"""
+Benchmark the page aggregation kernel against the previous groupby + apply code.
+
+Usage: python benchmark_aggregation.py [rows ...]
+"""
+
+from page_aggregation import aggregate_pages
+import numpy as np
+import pandas as pd
+import sys
+import time
+
+def groupby_apply_aggregate(df):
+    """The aggregation process_single_department used before page_aggregation"""
+    agg_dict = {
+        "Page Title": "first",
+        "Views": "sum",
+        "Users": "sum",
+        "Engagement Time (sec)": "sum",
+        "Bounce Rate (%)": "mean",
+        "Event Count": "sum"
+    }
+    grouped = df.groupby(["Normalized Path", "URL"], as_index=False).agg(agg_dict)
+    grouped["Views per User"] = grouped.apply(
+        lambda row: round(row["Views"] / row["Users"], 2) if row["Users"] != 0 else 0, axis=1
+    )
+    grouped["Engagement Time Per View"] = grouped.apply(
+        lambda row: round(row["Engagement Time (sec)"] / row["Views"], 2) if row["Views"] != 0 else 0, axis=1
+    )
+    return grouped.drop(columns=["Engagement Time (sec)", "Normalized Path"])
+
+def synthetic_rows(n, seed=0):
+    """Processed rows shaped like process_analytics_data output, about four rows per page"""
+    rng = np.random.default_rng(seed)
+    paths = np.array([f"/dept/page-{i}/" for i in rng.integers(0, max(1, n // 4), n)], dtype=object)
+    return pd.DataFrame({
+        "Page Title": np.array([f"Title {i}" for i in rng.integers(0, 3, n)], dtype=object),
+        "URL": "https://www.example.edu" + paths,
+        "Normalized Path": paths,
+        "Views": rng.integers(0, 500, n),
+        "Users": rng.integers(0, 100, n),
+        "Engagement Time (sec)": np.round(rng.random(n) * 1000, 2),
+        "Bounce Rate (%)": rng.random(n) * 100,
+        "Event Count": rng.integers(0, 900, n),
+    })
+
+def best_time(func, df, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(df)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 50000, 200000]
+    print(f"{'rows':>10} {'pages':>10} {'groupby+apply':>15} {'kernel':>10} {'speedup':>9}")
+    for n in sizes:
+        df = synthetic_rows(n)
+        expected = groupby_apply_aggregate(df)
+        if not aggregate_pages(df).equals(expected):
+            print(f"Results differ for {n} rows")
+            return False
+        old = best_time(groupby_apply_aggregate, df)
+        new = best_time(aggregate_pages, df)
+        print(f"{n:>10} {len(expected):>10} {old:>14.3f}s {new:>9.3f}s {old / new:>8.1f}x")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,246 @@
+"""
+Incremental refresh of the rolling report window from per-day partitions.
+
+Each day's pagePath/pageTitle metrics are stored in SQLite once they are
+fetched. A run only asks GA for days that are missing or still settling, then
+rebuilds the window's rows from the stored partitions. Distinct users can't be
+added up across days, so they come from one activeUsers-only query over the
+whole window, limited to the requested departments' pages.
+"""
+
+from datetime import date, timedelta
+from google.analytics.data_v1beta.types import DimensionValue, FilterExpression, MetricValue, Row, RunReportRequest, Dimension, Metric
+from ga_reports import GA_CACHE_DIR, departments_filter, page_filter, run_report_paginated
+from ga_filters import compile_page_filter
+from response_cache import fingerprint
+from dotenv import load_dotenv
+import os
+import re
+import sqlite3
+
+# Load environment variables
+load_dotenv()
+
+DAILY_STORE_PATH = os.getenv('DAILY_STORE_PATH') or os.path.join(GA_CACHE_DIR, 'daily_partitions.sqlite3')
+# GA keeps revising recent days, so a day fetched within SETTLE_DAYS of its date is fetched again
+SETTLE_DAYS = int(os.getenv('SETTLE_DAYS', '3'))
+
+# Per-day metrics; bounce rate is rebuilt from sessions and engaged sessions, and
+# the daily activeUsers are only used for pages missing from the window users query
+DAILY_METRICS = [
+    "screenPageViews",
+    "activeUsers",
+    "userEngagementDuration",
+    "sessions",
+    "engagedSessions",
+    "eventCount",
+]
+
+def resolve_date(value, today=None):
+    """Turn a GA date string (YYYY-MM-DD, today, yesterday, NdaysAgo) into a date"""
+    today = today or date.today()
+    if value == "today":
+        return today
+    if value == "yesterday":
+        return today - timedelta(days=1)
+    match = re.fullmatch(r"(\d+)daysAgo", value)
+    if match:
+        return today - timedelta(days=int(match.group(1)))
+    return date.fromisoformat(value)
+
+def contiguous_ranges(days):
+    """Group sorted days into (first, last) runs of consecutive dates"""
+    ranges = []
+    for day in sorted(days):
+        if ranges and day == ranges[-1][1] + timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(r) for r in ranges]
+
+def build_daily_report_request(property_id, start_day, end_day, dimension_filter=None):
+    """Build the date/pagePath/pageTitle request that feeds the daily partitions"""
+    request = RunReportRequest(
+        property="properties/" + property_id,
+        dimensions=[Dimension(name="date"), Dimension(name="pagePath"), Dimension(name="pageTitle")],
+        metrics=[Metric(name=name) for name in DAILY_METRICS],
+        date_ranges=[{"start_date": start_day.isoformat(), "end_date": end_day.isoformat()}],
+    )
+    if dimension_filter is not None:
+        request.dimension_filter = dimension_filter
+    return request
+
+def build_window_users_request(property_id, start_day, end_day, dimension_filter=None):
+    """Build the pagePath/pageTitle request for distinct activeUsers over the whole window"""
+    request = RunReportRequest(
+        property="properties/" + property_id,
+        dimensions=[Dimension(name="pagePath"), Dimension(name="pageTitle")],
+        metrics=[Metric(name="activeUsers")],
+        date_ranges=[{"start_date": start_day.isoformat(), "end_date": end_day.isoformat()}],
+    )
+    if dimension_filter is not None:
+        request.dimension_filter = dimension_filter
+    return request
+
+def window_users(rows):
+    """Map (pagePath, pageTitle) to the window's distinct activeUsers"""
+    return {
+        (row.dimension_values[0].value, row.dimension_values[1].value): _number(row.metric_values[0].value, int)
+        for row in rows
+    }
+
+def partition_key(property_id, dimension_filter):
+    """Store key for a property's partitions; rows fetched under different exclusion rules are kept apart"""
+    if dimension_filter is None:
+        return property_id
+    return f"{property_id}:{fingerprint(FilterExpression.serialize(dimension_filter))[:12]}"
+
+def _number(value, cast):
+    return cast(value) if value not in ("", None) else cast(0)
+
+class DailyPartitionStore:
+    """SQLite store of per-day, per-page metrics for each property"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS partitions ("
+                " property_id TEXT NOT NULL, day TEXT NOT NULL,"
+                " page_path TEXT NOT NULL, page_title TEXT NOT NULL,"
+                " views INTEGER, users INTEGER, engagement REAL,"
+                " sessions INTEGER, engaged_sessions INTEGER, events INTEGER)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS partitions_day ON partitions (property_id, day)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fetched_days ("
+                " property_id TEXT NOT NULL, day TEXT NOT NULL, fetched_on TEXT NOT NULL,"
+                " PRIMARY KEY (property_id, day))"
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def stale_days(self, property_id, days):
+        """Days that have never been fetched, or were fetched before they had settled"""
+        conn = self._connect()
+        try:
+            fetched = dict(conn.execute(
+                "SELECT day, fetched_on FROM fetched_days WHERE property_id = ?", (property_id,)
+            ))
+        finally:
+            conn.close()
+        stale = []
+        for day in days:
+            fetched_on = fetched.get(day.isoformat())
+            if fetched_on is None or date.fromisoformat(fetched_on) < day + timedelta(days=SETTLE_DAYS):
+                stale.append(day)
+        return stale
+
+    def replace_days(self, property_id, days, rows, fetched_on):
+        """Replace the stored partitions for days with rows from a daily report"""
+        day_keys = [(property_id, day.isoformat()) for day in days]
+        records = []
+        for row in rows:
+            dims = row.dimension_values
+            metrics = row.metric_values
+            raw_day = dims[0].value
+            records.append((
+                property_id,
+                f"{raw_day[:4]}-{raw_day[4:6]}-{raw_day[6:8]}",
+                dims[1].value,
+                dims[2].value,
+                _number(metrics[0].value, int),
+                _number(metrics[1].value, int),
+                _number(metrics[2].value, float),
+                _number(metrics[3].value, int),
+                _number(metrics[4].value, int),
+                _number(metrics[5].value, int),
+            ))
+        conn = self._connect()
+        try:
+            conn.executemany("DELETE FROM partitions WHERE property_id = ? AND day = ?", day_keys)
+            conn.executemany("INSERT INTO partitions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+            conn.executemany(
+                "INSERT OR REPLACE INTO fetched_days VALUES (?, ?, ?)",
+                [key + (fetched_on.isoformat(),) for key in day_keys],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def prune(self, property_id, before):
+        """Drop partitions that have rolled out of the window"""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM partitions WHERE property_id = ? AND day < ?", (property_id, before.isoformat()))
+            conn.execute("DELETE FROM fetched_days WHERE property_id = ? AND day < ?", (property_id, before.isoformat()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def aggregate_rows(self, property_id, start_day, end_day, users=None):
+        """Sum stored partitions over the window into pagePath/pageTitle report rows.
+
+        users maps (pagePath, pageTitle) to the window's distinct users; pages
+        it doesn't cover keep the sum of their daily users.
+        """
+        users_by_page = users or {}
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "SELECT page_path, page_title, SUM(views), SUM(users), SUM(engagement),"
+                " SUM(sessions), SUM(engaged_sessions), SUM(events)"
+                " FROM partitions WHERE property_id = ? AND day BETWEEN ? AND ?"
+                " GROUP BY page_path, page_title",
+                (property_id, start_day.isoformat(), end_day.isoformat()),
+            )
+            rows = []
+            for path, title, views, daily_users, engagement, sessions, engaged, events in cursor:
+                bounce_rate = 1 - engaged / sessions if sessions else 0.0
+                users = users_by_page.get((path, title), daily_users)
+                rows.append(Row(
+                    dimension_values=[DimensionValue(value=path), DimensionValue(value=title)],
+                    metric_values=[
+                        MetricValue(value=str(views)),
+                        MetricValue(value=str(users)),
+                        MetricValue(value=repr(engagement)),
+                        MetricValue(value=repr(bounce_rate)),
+                        MetricValue(value=str(events)),
+                    ],
+                ))
+            return rows
+        finally:
+            conn.close()
+
+def fetch_incremental_site_rows(client, start_date, end_date, property_id, store=None, dept_paths=None):
+    """Return the window's pagePath/pageTitle rows, fetching only missing or settling days.
+
+    Rows have the same shape as the page report, so they can be partitioned to
+    departments like a site-wide fetch. Window users are only fetched for pages
+    under dept_paths, if given; other pages keep the sum of their daily users.
+    """
+    store = store or DailyPartitionStore(DAILY_STORE_PATH)
+    today = date.today()
+    start_day = resolve_date(start_date, today)
+    end_day = resolve_date(end_date, today)
+    days = [start_day + timedelta(days=offset) for offset in range((end_day - start_day).days + 1)]
+    dimension_filter = page_filter()
+    key = partition_key(property_id, dimension_filter)
+    stale = store.stale_days(key, days)
+    for first_day, last_day in contiguous_ranges(stale):
+        print(f"Refreshing daily partitions {first_day} to {last_day}")
+        request = build_daily_report_request(property_id, first_day, last_day, dimension_filter)
+        range_days = [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+        store.replace_days(key, range_days, run_report_paginated(client, request), fetched_on=today)
+    store.prune(key, before=start_day)
+    users_filter = compile_page_filter(departments_filter(dept_paths)) if dept_paths else dimension_filter
+    users_request = build_window_users_request(property_id, start_day, end_day, users_filter)
+    users = window_users(run_report_paginated(client, users_request))
+    return store.aggregate_rows(key, start_day, end_day, users)
@@ -0,0 +1,178 @@
+"""
+One department's report, shared by the web apps and the command-line script.
+
+Rows are decoded and aggregated per page, ranked and checked against the
+review rules, the summary is started in the background, and the report files
+are written to their targets or handed to a render pool for the caller to
+collect. Without worker processes, InlineRenderer stands in for the pool so
+batched summaries are all started before the first report waits for one.
+"""
+
+from urllib.parse import urlparse
+from ga_reports import fetch_analytics_data, fetch_total_site_views
+from ai_insights import get_ai_insights, start_ai_insights, summary_sheet
+from path_canonicalizer import path_canonicalizer
+from page_aggregation import aggregate_pages
+from output_sinks import get_sink
+from ranking import SUMMARY_PAGES, TOP_PAGES, PageRanking
+from review_rules import pages_to_review
+from row_decoder import decode_rows, map_distinct, round_values
+import pandas as pd
+
+def normalize_path(path):
+    return path_canonicalizer.canonicalize(path)
+
+def clean_page_title(title):
+    if ' - ' in title:
+        return title.split(' - ', 1)[0].strip()
+    return title.strip()
+
+def process_analytics_data(rows, base_url):
+    """Process raw analytics rows into a DataFrame"""
+    columns = decode_rows(rows)
+    norm_paths = path_canonicalizer.canonicalize_many(columns["path"])
+    return pd.DataFrame({
+        "Page Title": map_distinct(clean_page_title, columns["title"]),
+        "URL": base_url + norm_paths,
+        "Normalized Path": norm_paths,
+        "Views": columns["views"],
+        "Users": columns["users"],
+        "Engagement Time (sec)": round_values(columns["engagement"], 2),
+        "Bounce Rate (%)": columns["bounce_rate"] * 100,
+        "Event Count": columns["events"],
+    }, copy=False)
+
+def analyze_pages(grouped_data, top_pages=TOP_PAGES, ranking=None):
+    """Analyze pages and create top pages and pages to review lists"""
+    # Take the top pages from the shared ranking, or rank just for them
+    ranking = ranking or PageRanking(grouped_data, top=top_pages)
+    top_20 = ranking.top(top_pages)
+    
+    # Identify pages to review
+    to_remove = pages_to_review(grouped_data)
+    
+    return top_20, to_remove
+
+def report_sheets(top_20, to_remove, grouped_data, ai_summary, top_pages=TOP_PAGES):
+    """The report's (title, DataFrame) sheets in workbook order.
+
+    The Summary sheet is a DeferredSheet while the summary is still being
+    generated, so it is only waited for once the other sheets are written.
+    """
+    return [
+        ("Summary", summary_sheet(ai_summary)),
+        (f"Top {top_pages} Pages", top_20),
+        ("Pages to Review", to_remove),
+        ("All Pages", grouped_data),
+    ]
+
+def write_report(targets, sheets, sink=None, label=None):
+    """Write the report sheets to targets in the sink's output format; label names the report in errors"""
+    sink = sink or get_sink()
+    try:
+        sink.write(targets, sheets)
+        return True
+    except Exception as e:
+        print(f"Error writing {sink.label} report for {label or ', '.join(map(str, targets))}: {e!r}")
+        return False
+
+class InlineRenderer:
+    """RenderPool stand-in that writes each report in this process when it is collected"""
+
+    def submit(self, sink, targets, sheets):
+        return (sink, sheets)
+
+    def collect(self, render, targets, label):
+        """Write a submitted report to targets; True on success"""
+        sink, sheets = render
+        return write_report(targets, sheets, sink, label)
+
+def process_single_department(url, client, start_date, end_date, targets, property_id,
+                              rows=None, total_site_views=None, ai_insights=get_ai_insights, top_pages=TOP_PAGES,
+                              sink=None, render_pool=None):
+    """Process a single department URL and write its report files to targets"""
+    try:
+        sink = sink or get_sink()
+        
+        # Parse URL and get department path
+        parsed_url = urlparse(url)
+        dept_path = normalize_path(parsed_url.path)
+        base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
+        
+        # Fetch analytics data unless rows were already partitioned from a site-wide fetch
+        if rows is None:
+            rows = list(fetch_analytics_data(client, dept_path, start_date, end_date, property_id))
+        
+        if not rows:
+            return {"success": False, "error": f"No data found for {url}"}
+        
+        # Process the data
+        df = process_analytics_data(rows, base_url)
+        
+        if df.empty:
+            return {"success": False, "error": f"No valid data found for {url}"}
+        
+        # Group data and calculate derived metrics
+        grouped = aggregate_pages(df)
+        
+        # Remove error pages
+        grouped = grouped[grouped["Page Title"] != "Oops! We can't seem to find that page."]
+        
+        # Rank pages by views once for the top pages sheet and the summary lists
+        ranking = PageRanking(grouped, top=max(top_pages, SUMMARY_PAGES), bottom=SUMMARY_PAGES)
+        
+        # Analyze pages
+        top_20, to_remove = analyze_pages(grouped, top_pages, ranking)
+        
+        # Get total site views for percentage calculation
+        if total_site_views is None:
+            total_site_views = fetch_total_site_views(client, start_date, end_date, property_id)
+        
+        section_views = grouped["Views"].sum()
+        section_traffic_percentage = round((section_views / total_site_views) * 100, 2) if total_site_views > 0 else 0.0
+        
+        # Calculate overall statistics
+        overall_stats = {
+            "total_pages": len(grouped),
+            "total_views": grouped["Views"].sum(),
+            "average_views": grouped["Views"].mean(),
+            "average_users": grouped["Users"].mean(),
+            "average_engagement_time_per_view": grouped["Engagement Time Per View"].mean(),
+            "average_bounce_rate": grouped["Bounce Rate (%)"].mean(),
+            "pages_with_high_bounce": grouped[grouped["Bounce Rate (%)"] > 80].shape[0],
+            "pages_with_low_views": grouped[grouped["Views"] < 10].shape[0],
+            "top_5_pages": ranking.top(SUMMARY_PAGES)[["Page Title", "Views"]].to_dict('records'),
+            "bottom_5_pages": ranking.bottom(SUMMARY_PAGES)[["Page Title", "Views"]].to_dict('records'),
+            "top_pages": top_pages,
+        }
+        
+        # Start the AI insights in the background, unless the output format has no summary sheet,
+        # so they are generated while the data sheets are written
+        ai_summary = ""
+        if sink.needs_summary:
+            ai_summary = start_ai_insights(ai_insights, grouped, section_traffic_percentage, overall_stats)
+        
+        # Write the report files, or hand them to the render pool for the caller to collect
+        sheets = report_sheets(top_20, to_remove, grouped, ai_summary, top_pages)
+        render = None
+        if render_pool is not None:
+            render = render_pool.submit(sink, targets, sheets)
+            success = True
+        else:
+            success = write_report(targets, sheets, sink, url)
+        
+        if success:
+            return {
+                "success": True,
+                "render": render,
+                "stats": {
+                    "total_pages": overall_stats["total_pages"],
+                    "total_views": overall_stats["total_views"],
+                    "section_traffic_percentage": section_traffic_percentage
+                }
+            }
+        else:
+            return {"success": False, "error": f"Failed to create {sink.label} report for {url}"}
+            
+    except Exception as e:
+        return {"success": False, "error": f"Error processing {url}: {str(e)}"}
@@ -0,0 +1,151 @@
+"""
+Single-pass workbook writer for the department reports.
+
+Sheets are streamed through an openpyxl write-only workbook in their final
+order, with column widths and header styles worked out before any row is
+written, so the file is serialized once and never read back. A sheet whose
+content is still being produced can be filled in after the others.
+"""
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.compat.numbers import NUMERIC_TYPES
+from openpyxl.compat.strings import safe_string
+from openpyxl.styles import Alignment, Border, Font, Side
+from openpyxl.utils import get_column_letter
+from pandas.api.types import infer_dtype, is_bool_dtype, is_float_dtype, is_integer_dtype
+from dotenv import load_dotenv
+import math
+import numpy as np
+import os
+import pandas as pd
+
+# Load environment variables
+load_dotenv()
+
+# Float columns with more values than this are auto-fitted from a random sample of them
+AUTOFIT_SAMPLE_ROWS = int(os.getenv('AUTOFIT_SAMPLE_ROWS', '20000'))
+
+# pandas' bold, boxed header with the wrap/top alignment the reports use
+THIN = Side(style="thin")
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=THIN, right=THIN, top=THIN, bottom=THIN)
+WRAP_TOP = Alignment(wrap_text=True, vertical="top")
+
+def float_text_lengths(values):
+    """Lengths of displayed_text for an array of finite floats, without a Python loop"""
+    text = np.char.mod("%.16g", values)
+    lengths = np.char.str_len(text)
+    # Text with a point or exponent reads back as a float and is shown by repr
+    as_float = (np.char.find(text, ".") >= 0) | (np.char.find(text, "e") >= 0)
+    if as_float.any():
+        lengths[as_float] = pd.Series(text[as_float].astype(np.float64)).astype(str).str.len().to_numpy()
+    # "-0" reads back as the integer 0
+    lengths[text == "-0"] = 1
+    return lengths
+
+def column_width(name, series, sample_rows=AUTOFIT_SAMPLE_ROWS):
+    """Longest header or value as stored in the sheet, plus padding.
+
+    Float and mixed columns longer than sample_rows, whose values have to be
+    formatted one by one, are measured on a fixed random sample of them.
+    """
+    values = series.dropna()
+    longest = len(str(name))
+    if is_float_dtype(values.dtype):
+        values = values[np.isfinite(values.to_numpy())]
+    if len(values) == 0:
+        return longest + 2
+    if is_integer_dtype(values.dtype) and not is_bool_dtype(values.dtype):
+        # The longest integer is the largest or the most negative one
+        lengths = [len(displayed_text(values.max())), len(displayed_text(values.min()))]
+    elif infer_dtype(values, skipna=True) == "string":
+        lengths = values.str.len().to_numpy()
+    else:
+        if sample_rows and len(values) > sample_rows:
+            values = values.sample(sample_rows, random_state=0)
+        if is_float_dtype(values.dtype):
+            lengths = float_text_lengths(values.to_numpy())
+        else:
+            lengths = values.map(displayed_text).str.len().to_numpy()
+    return max(longest, int(max(lengths))) + 2
+
+def column_widths(df):
+    """Width per column of df, computed column-wise before anything is written"""
+    return [column_width(name, df[name]) for name in df.columns]
+
+def displayed_text(value):
+    """Text of a value as it reads back from the sheet.
+
+    Numbers are stored with 16 significant digits and read back as int or
+    float depending on that text, so e.g. 60.012551060186354 reads back as
+    60.01255106018635 and 2.0 as 2.
+    """
+    if isinstance(value, (str, bool)) or not isinstance(value, NUMERIC_TYPES):
+        return str(value)
+    text = safe_string(value)
+    if "." in text or "E" in text.upper():
+        return str(float(text))
+    return str(int(text))
+
+def _is_blank(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+def _cell(ws, value, font=None, border=None, alignment=None):
+    cell = WriteOnlyCell(ws, value=value)
+    if font is not None:
+        cell.font = font
+    if border is not None:
+        cell.border = border
+    if alignment is not None:
+        cell.alignment = alignment
+    return cell
+
+def write_sheet(wb, title, df, wrap_values=False):
+    """Stream one DataFrame into a new write-only sheet"""
+    return fill_sheet(wb.create_sheet(title), df, wrap_values)
+
+def fill_sheet(ws, df, wrap_values=False):
+    """Stream one DataFrame into an empty write-only sheet"""
+    if len(df.columns) == 0:
+        return ws
+    # Column dimensions have to be in place before the first row is written
+    for idx, width in enumerate(column_widths(df), start=1):
+        ws.column_dimensions[get_column_letter(idx)].width = width
+    ws.append([_cell(ws, str(name), HEADER_FONT, HEADER_BORDER, WRAP_TOP) for name in df.columns])
+    for row in df.itertuples(index=False, name=None):
+        values = [None if _is_blank(value) else value for value in row]
+        if wrap_values:
+            values = [_cell(ws, value, alignment=WRAP_TOP) for value in values]
+        ws.append(values)
+    return ws
+
+class DeferredSheet:
+    """Sheet whose DataFrame is built from a Future's result; call it to wait for the Future and build it"""
+
+    def __init__(self, future, build):
+        self.future = future
+        self.build = build
+
+    def __call__(self):
+        return self.build(self.future.result())
+
+def write_workbook(filename, sheets, wrap_sheets=()):
+    """Write (title, DataFrame) pairs to filename in order.
+
+    Value cells on sheets named in wrap_sheets are wrapped and top-aligned.
+    A sheet given as a zero-argument callable returning its DataFrame, such
+    as a DeferredSheet, keeps its place but is filled last, so e.g. the AI
+    summary can still be on its way while the data sheets are written.
+    """
+    wb = Workbook(write_only=True)
+    deferred = []
+    for title, df in sheets:
+        ws = wb.create_sheet(title)
+        if callable(df):
+            deferred.append((ws, title, df))
+        else:
+            fill_sheet(ws, df, wrap_values=title in wrap_sheets)
+    for ws, title, load in deferred:
+        fill_sheet(ws, load(), wrap_values=title in wrap_sheets)
+    wb.save(filename)
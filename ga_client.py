@@ -0,0 +1,129 @@
+"""
+Process-wide pool of Google Analytics Data API clients.
+
+Credentials are loaded once (from CREDENTIALS_JSON in memory, or from the key
+file), gRPC channels are created once and kept alive, and access tokens are
+refreshed in a background thread so requests never pay for channel setup or
+token minting.
+"""
+
+from google.analytics.data_v1beta import BetaAnalyticsDataClient
+from google.analytics.data_v1beta.services.beta_analytics_data.transports import BetaAnalyticsDataGrpcTransport
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+from dotenv import load_dotenv
+from datetime import datetime
+import itertools
+import json
+import os
+import threading
+import time
+
+# Load environment variables
+load_dotenv()
+
+# Number of gRPC channels requests are spread across
+GA_CLIENT_POOL_SIZE = int(os.getenv('GA_CLIENT_POOL_SIZE', '2'))
+# Refresh access tokens this many seconds before they expire
+TOKEN_REFRESH_MARGIN = int(os.getenv('GA_TOKEN_REFRESH_MARGIN', '300'))
+
+GA_HOST = BetaAnalyticsDataClient.DEFAULT_ENDPOINT + ":443"
+# Ping idle channels so load balancers do not drop them between requests
+CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+    ("grpc.max_receive_message_length", -1),
+]
+
+def load_credentials(key_path):
+    """Load service account credentials from CREDENTIALS_JSON, or the key file if it is unset"""
+    credentials_json = os.getenv('CREDENTIALS_JSON')
+    if credentials_json:
+        credentials = service_account.Credentials.from_service_account_info(json.loads(credentials_json))
+    else:
+        credentials = service_account.Credentials.from_service_account_file(key_path)
+    return credentials.with_scopes(BetaAnalyticsDataGrpcTransport.AUTH_SCOPES)
+
+def credentials_available(key_path):
+    return bool(os.getenv('CREDENTIALS_JSON')) or os.path.exists(key_path)
+
+class GAClientPool:
+    """Long-lived BetaAnalyticsDataClient instances sharing one set of credentials"""
+
+    def __init__(self, key_path, size=GA_CLIENT_POOL_SIZE):
+        self.key_path = key_path
+        self.size = max(1, size)
+        self._credentials = None
+        self._clients = []
+        self._next_client = None
+        self._refresher = None
+        self._lock = threading.Lock()
+
+    @property
+    def credentials(self):
+        """Credentials shared by every pooled client, loaded on first use"""
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = load_credentials(self.key_path)
+            return self._credentials
+
+    def _create_client(self, credentials):
+        channel = BetaAnalyticsDataGrpcTransport.create_channel(
+            GA_HOST,
+            credentials=credentials,
+            options=CHANNEL_OPTIONS,
+        )
+        return BetaAnalyticsDataClient(transport=BetaAnalyticsDataGrpcTransport(channel=channel))
+
+    def client(self):
+        """Return a pooled client, creating the channels on first use"""
+        credentials = self.credentials
+        with self._lock:
+            if not self._clients:
+                self._clients = [self._create_client(credentials) for _ in range(self.size)]
+                self._next_client = itertools.cycle(self._clients)
+            client = next(self._next_client)
+        self.start_refresher()
+        return client
+
+    def refresh_token(self):
+        """Mint a new access token if the current one is missing or about to expire"""
+        credentials = self.credentials
+        expiry = credentials.expiry
+        if credentials.token is None or expiry is None or \
+                (expiry - datetime.utcnow()).total_seconds() < TOKEN_REFRESH_MARGIN:
+            credentials.refresh(Request())
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh_token()
+                expiry = self.credentials.expiry
+                delay = (expiry - datetime.utcnow()).total_seconds() - TOKEN_REFRESH_MARGIN if expiry else 60
+            except Exception as e:
+                print(f"Google Analytics token refresh failed: {e}")
+                delay = 60
+            time.sleep(max(30, delay))
+
+    def start_refresher(self):
+        """Keep the access token fresh in a daemon thread"""
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, name="ga-token-refresh", daemon=True)
+            self._refresher.start()
+
+    def warm_in_background(self):
+        """Load credentials, open channels and mint a token without blocking startup"""
+        if not credentials_available(self.key_path):
+            return
+
+        def warm():
+            try:
+                self.client()
+            except Exception as e:
+                print(f"Could not warm up Google Analytics client: {e}")
+
+        threading.Thread(target=warm, name="ga-client-warmup", daemon=True).start()
@@ -0,0 +1,72 @@
+"""
+Server-side exclusion rules for the pagePath/pageTitle reports.
+
+Rows that would be thrown away after download (the site's error page, query
+string variants of a page) are excluded by GA itself, so they are never sent,
+parsed or grouped. Rules compile to a FilterExpression tree: one NOT
+expression per rule, combined in an AND group with the department prefix.
+"""
+
+from google.analytics.data_v1beta.types import Filter, FilterExpression, FilterExpressionList
+from dotenv import load_dotenv
+import os
+import re
+
+# Load environment variables
+load_dotenv()
+
+ERROR_PAGE_TITLE = "Oops! We can't seem to find that page."
+
+# Set GA_SERVER_FILTERS=false to download every row and only filter after download
+SERVER_FILTERS = os.getenv('GA_SERVER_FILTERS', 'true').lower() == 'true'
+# Page titles whose rows are dropped, compared after clean_page_title
+EXCLUDED_TITLES = [ERROR_PAGE_TITLE]
+# Full-match RE2 patterns for pagePath values that are dropped
+EXCLUDED_PATH_PATTERNS = [r".*\?.*"]
+if os.getenv('GA_EXCLUDE_PATH_REGEX'):
+    EXCLUDED_PATH_PATTERNS.append(os.getenv('GA_EXCLUDE_PATH_REGEX'))
+
+def title_pattern(title):
+    """Regex matching raw pageTitle values that clean_page_title turns into title.
+
+    clean_page_title keeps the text before the first " - " and strips it, so
+    "Oops! We can't seem to find that page. - Site Name" is matched as well.
+    """
+    # Escape RE2 metacharacters only
+    literal = re.sub(r"([\\.^$|?*+()\[\]{}])", r"\\\1", title)
+    return r"\s*" + literal + r"\s*( - .*)?"
+
+def regex_filter(field_name, pattern):
+    return FilterExpression(
+        filter=Filter(
+            field_name=field_name,
+            string_filter={"value": pattern, "match_type": "FULL_REGEXP", "case_sensitive": True}
+        )
+    )
+
+def exclude(expression):
+    return FilterExpression(not_expression=expression)
+
+def and_filters(*expressions):
+    """AND the given expressions together, skipping None; None if nothing is left"""
+    expressions = [expression for expression in expressions if expression is not None]
+    if not expressions:
+        return None
+    if len(expressions) == 1:
+        return expressions[0]
+    return FilterExpression(and_group=FilterExpressionList(expressions=expressions))
+
+def exclusion_filters(titles=None, path_patterns=None):
+    """One NOT expression per excluded title and path pattern"""
+    if not SERVER_FILTERS:
+        return []
+    titles = EXCLUDED_TITLES if titles is None else titles
+    path_patterns = EXCLUDED_PATH_PATTERNS if path_patterns is None else path_patterns
+    return (
+        [exclude(regex_filter("pageTitle", title_pattern(title))) for title in titles] +
+        [exclude(regex_filter("pagePath", pattern)) for pattern in path_patterns]
+    )
+
+def compile_page_filter(prefix_filter=None, titles=None, path_patterns=None):
+    """Combine an optional department prefix filter with the exclusion rules"""
+    return and_filters(prefix_filter, *exclusion_filters(titles, path_patterns))
@@ -0,0 +1,210 @@
+"""
+Quota-aware scheduling for Google Analytics Data API report requests.
+
+Every request asks GA to return the property quota. The scheduler tracks the
+remaining hourly and daily tokens and the concurrent-request allowance, and
+paces queued requests with a token bucket so large batches slow down before
+GA starts answering RESOURCE_EXHAUSTED.
+"""
+
+from google.analytics.data_v1beta.types import BatchRunReportsRequest, RunReportRequest
+from google.api_core.exceptions import ResourceExhausted
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from dotenv import load_dotenv
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+# Load environment variables
+load_dotenv()
+
+# Standard GA4 property limits; raise these for Analytics 360 properties
+QUOTA_TOKENS_PER_HOUR = int(os.getenv('GA_TOKENS_PER_HOUR', '40000'))
+QUOTA_TOKENS_PER_DAY = int(os.getenv('GA_TOKENS_PER_DAY', '200000'))
+QUOTA_CONCURRENT_REQUESTS = int(os.getenv('GA_CONCURRENT_REQUESTS', '10'))
+# Tokens left untouched so other tools sharing the property keep working
+QUOTA_RESERVE_TOKENS = int(os.getenv('GA_QUOTA_RESERVE_TOKENS', '500'))
+QUOTA_MAX_RETRIES = int(os.getenv('GA_QUOTA_MAX_RETRIES', '4'))
+# GA4 daily quotas refresh at midnight Pacific Time
+QUOTA_TIMEZONE = os.getenv('GA_QUOTA_TIMEZONE', 'America/Los_Angeles')
+
+# Priorities: lower numbers are served first
+PRIORITY_CONTINUATION = 0
+PRIORITY_DEFAULT = 1
+
+class QuotaExhausted(Exception):
+    """Raised when the daily token quota cannot cover another request"""
+
+def quota_day(timezone=QUOTA_TIMEZONE):
+    """Date of the current daily quota period"""
+    return datetime.now(ZoneInfo(timezone)).date()
+
+class QuotaScheduler:
+    """Token-bucket pacing of report requests against the reported property quota.
+
+    The local counts are only estimates between responses: each GA response
+    overwrites them with the quota GA reports, and the daily count starts over
+    when the quota day changes.
+    """
+
+    def __init__(self, tokens_per_hour=QUOTA_TOKENS_PER_HOUR, tokens_per_day=QUOTA_TOKENS_PER_DAY,
+                 concurrent_requests=QUOTA_CONCURRENT_REQUESTS, reserve=QUOTA_RESERVE_TOKENS,
+                 max_retries=QUOTA_MAX_RETRIES, clock=time.monotonic, today=quota_day):
+        self.tokens_per_hour = tokens_per_hour
+        self.tokens_per_day = tokens_per_day
+        self.reserve = reserve
+        self.max_retries = max_retries
+        self.max_concurrent = concurrent_requests
+        self.concurrent_limit = concurrent_requests
+        # Bucket of hourly tokens, refilled at the hourly rate
+        self.hourly_tokens = float(tokens_per_hour)
+        self.daily_tokens = float(tokens_per_day)
+        self.refill_rate = tokens_per_hour / 3600.0
+        # Running estimate of the tokens a single report costs
+        self.estimated_cost = 10.0
+        self.in_flight = 0
+        # Tokens reserved by requests GA hasn't answered yet
+        self.reserved = 0.0
+        self._clock = clock
+        self._today = today
+        self._day = today()
+        self._last_refill = clock()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = self._clock()
+        self.hourly_tokens = min(self.tokens_per_hour, self.hourly_tokens + (now - self._last_refill) * self.refill_rate)
+        self._last_refill = now
+        day = self._today()
+        if day != self._day:
+            self._day = day
+            self.daily_tokens = float(self.tokens_per_day) - self.reserved
+
+    def _wait_time(self, cost):
+        """Seconds until the head request may start, or 0 if it can start now"""
+        if self.in_flight >= self.concurrent_limit:
+            return None
+        if self.daily_tokens - cost < self.reserve:
+            raise QuotaExhausted("Google Analytics daily token quota is nearly used up; try again tomorrow.")
+        deficit = cost + self.reserve - self.hourly_tokens
+        return deficit / self.refill_rate if deficit > 0 else 0
+
+    def acquire(self, requests=1, priority=PRIORITY_DEFAULT):
+        """Block until a request slot and enough tokens are available; return the reserved cost"""
+        with self._condition:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    self._refill()
+                    cost = self.estimated_cost * requests
+                    wait = None
+                    if self._waiters[0] == ticket:
+                        wait = self._wait_time(cost)
+                        if wait == 0:
+                            self.in_flight += 1
+                            self.reserved += cost
+                            self.hourly_tokens -= cost
+                            self.daily_tokens -= cost
+                            return cost
+                    # Waiting for a slot is woken by release(); waiting for tokens times out on refill
+                    self._condition.wait(timeout=wait)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+
+    def release(self, reserved_cost, property_quotas=()):
+        """Free a request slot and resynchronise the bucket with the quota GA reported"""
+        with self._condition:
+            self.in_flight -= 1
+            self.reserved -= reserved_cost
+            reported = [quota for quota in property_quotas if quota]
+            if reported:
+                # The latest response is authoritative; only requests still in flight aren't counted in it yet
+                latest = reported[-1]
+                self.hourly_tokens = float(latest.tokens_per_hour.remaining) - self.reserved
+                self.daily_tokens = float(latest.tokens_per_day.remaining) - self.reserved
+                self._last_refill = self._clock()
+                self._day = self._today()
+                # GA counts our own in-flight requests as consumed, so add them back
+                allowance = latest.concurrent_requests.remaining + self.in_flight + 1
+                self.concurrent_limit = max(1, min(self.max_concurrent, allowance))
+                consumed = sum(quota.tokens_per_hour.consumed for quota in reported)
+                if consumed:
+                    # Move the estimate toward what GA charged per report
+                    self.estimated_cost = 0.8 * self.estimated_cost + 0.2 * (consumed / len(reported))
+            self._condition.notify_all()
+
+    def exhausted(self, error, attempt):
+        """Back off after RESOURCE_EXHAUSTED, tightening whichever limit GA reported"""
+        with self._condition:
+            if "concurrent" in str(error).lower():
+                self.concurrent_limit = max(1, self.concurrent_limit - 1)
+            else:
+                # Token quota ran out: stop sending until the bucket has refilled
+                self.hourly_tokens = min(self.hourly_tokens, 0.0)
+            self._condition.notify_all()
+        time.sleep(min(60, 2 ** attempt) * (0.5 + random.random()))
+
+    def _call(self, send, requests, priority):
+        attempt = 0
+        while True:
+            reserved = self.acquire(requests, priority)
+            quotas = ()
+            try:
+                resp = send()
+                quotas = [report.property_quota for report in getattr(resp, 'reports', [resp])]
+                return resp
+            except ResourceExhausted as e:
+                if attempt >= self.max_retries:
+                    raise
+                error = e
+            finally:
+                self.release(reserved, quotas)
+            self.exhausted(error, attempt)
+            attempt += 1
+
+    def run_report(self, client, request, priority=PRIORITY_DEFAULT):
+        """Send a RunReportRequest once the quota allows it"""
+        request = RunReportRequest(request)
+        request.return_property_quota = True
+        return self._call(lambda: client.run_report(request), 1, priority)
+
+    async def run_report_async(self, client, request, priority=PRIORITY_DEFAULT):
+        """Send a RunReportRequest through an async client once the quota allows it"""
+        request = RunReportRequest(request)
+        request.return_property_quota = True
+        attempt = 0
+        while True:
+            reserved = await asyncio.to_thread(self.acquire, 1, priority)
+            quotas = ()
+            try:
+                resp = await client.run_report(request)
+                quotas = [resp.property_quota]
+                return resp
+            except ResourceExhausted as e:
+                if attempt >= self.max_retries:
+                    raise
+                error = e
+            finally:
+                self.release(reserved, quotas)
+            await asyncio.to_thread(self.exhausted, error, attempt)
+            attempt += 1
+
+    def batch_run_reports(self, client, batch, priority=PRIORITY_DEFAULT):
+        """Send a BatchRunReportsRequest once the quota allows all of its reports"""
+        batch = BatchRunReportsRequest(batch)
+        for request in batch.requests:
+            request.return_property_quota = True
+        return self._call(lambda: client.batch_run_reports(batch), len(batch.requests), priority)
+
+# Shared by every report request in the process
+quota_scheduler = QuotaScheduler()
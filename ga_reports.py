@@ -0,0 +1,335 @@
+"""
+Google Analytics Data API helpers shared by the web app and the batch script.
+"""
+
+from google.analytics.data_v1beta.types import (
+    BatchRunReportsRequest,
+    Dimension,
+    Filter,
+    FilterExpression,
+    FilterExpressionList,
+    Metric,
+    RunReportRequest,
+    RunReportResponse,
+)
+from response_cache import DEFAULT_CACHE_DIR, ResponseCache, fingerprint
+from ga_filters import compile_page_filter
+from ga_quota import PRIORITY_CONTINUATION, PRIORITY_DEFAULT, quota_scheduler
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import asyncio
+import os
+import threading
+import time
+
+# Load environment variables
+load_dotenv()
+
+# Rows requested per RunReportRequest page (GA allows up to 250,000)
+ROW_LIMIT = int(os.getenv('GA_ROW_LIMIT', '100000'))
+# Report pages fetched in parallel once the row count is known
+FETCH_WORKERS = int(os.getenv('GA_FETCH_WORKERS', '4'))
+# GA accepts at most this many reports per batchRunReports call
+BATCH_SIZE = 5
+# Site-wide view totals are identical for every department, so keep them in memory
+SITE_TOTAL_CACHE_TTL = int(os.getenv('SITE_TOTAL_CACHE_TTL', '3600'))
+SITE_TOTAL_CACHE_SIZE = int(os.getenv('SITE_TOTAL_CACHE_SIZE', '32'))
+
+PAGE_DIMENSIONS = ["pagePath", "pageTitle"]
+PAGE_METRICS = [
+    "screenPageViews",
+    "activeUsers",
+    "userEngagementDuration",
+    "bounceRate",
+    "eventCount",
+]
+
+class TTLCache:
+    """Thread-safe in-process cache with per-entry expiry and least-recently-used eviction"""
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Keyed by (property_id, start_date, end_date)
+site_total_cache = TTLCache(SITE_TOTAL_CACHE_TTL, SITE_TOTAL_CACHE_SIZE)
+
+# Raw report responses persisted on disk, keyed by the serialized request
+GA_CACHE_DIR = os.getenv('GA_CACHE_DIR') or DEFAULT_CACHE_DIR
+ga_response_cache = ResponseCache(
+    os.path.join(GA_CACHE_DIR, 'ga_responses.sqlite3'),
+    ttl=int(os.getenv('GA_CACHE_TTL', '21600')),
+    max_bytes=int(os.getenv('GA_CACHE_MAX_MB', '256')) * 1024 * 1024,
+)
+
+def request_fingerprint(request):
+    """Cache key for a report request"""
+    return fingerprint(RunReportRequest.pb(request).SerializeToString(deterministic=True))
+
+def cached_run_report(client, request, priority=PRIORITY_DEFAULT):
+    """Run a report, serving repeat requests from the on-disk response cache"""
+    key = request_fingerprint(request)
+    cached = ga_response_cache.get(key)
+    if cached is not None:
+        return RunReportResponse.deserialize(cached)
+    resp = quota_scheduler.run_report(client, request, priority)
+    ga_response_cache.set(key, RunReportResponse.serialize(resp))
+    return resp
+
+def build_page_report_request(property_id, start_date, end_date, dimension_filter=None):
+    """Build the pagePath/pageTitle report request, optionally filtered"""
+    request = RunReportRequest(
+        property="properties/" + property_id,
+        dimensions=[Dimension(name=name) for name in PAGE_DIMENSIONS],
+        metrics=[Metric(name=name) for name in PAGE_METRICS],
+        date_ranges=[{"start_date": start_date, "end_date": end_date}],
+    )
+    if dimension_filter is not None:
+        request.dimension_filter = dimension_filter
+    return request
+
+def department_filter(dept_path):
+    """Filter a report to pages under the department path"""
+    return FilterExpression(
+        filter=Filter(
+            field_name="pagePath",
+            string_filter={"value": dept_path, "match_type": "BEGINS_WITH"}
+        )
+    )
+
+def departments_filter(dept_paths):
+    """Filter a report to pages under any of the department paths"""
+    filters = [department_filter(dept_path) for dept_path in dict.fromkeys(dept_paths)]
+    if len(filters) == 1:
+        return filters[0]
+    return FilterExpression(or_group=FilterExpressionList(expressions=filters))
+
+def page_filter(dept_path=None):
+    """Department prefix (if any) plus the server-side exclusion rules"""
+    return compile_page_filter(department_filter(dept_path) if dept_path else None)
+
+def build_site_total_request(property_id, start_date, end_date):
+    """Build the unfiltered site-wide screenPageViews request"""
+    return RunReportRequest(
+        property="properties/" + property_id,
+        metrics=[Metric(name="screenPageViews")],
+        date_ranges=[{"start_date": start_date, "end_date": end_date}]
+    )
+
+def parse_total_site_views(resp):
+    """Read the site-wide view count from a site total response"""
+    return int(resp.rows[0].metric_values[0].value) if resp.rows else 0
+
+def page_request(request, offset):
+    """Copy a report request for the ROW_LIMIT window starting at offset"""
+    request = RunReportRequest(request)
+    request.limit = ROW_LIMIT
+    request.offset = offset
+    return request
+
+def run_report_paginated(client, request, first_response=None):
+    """Run a report in ROW_LIMIT pages and yield every row.
+
+    The first page reports row_count, so the remaining offset windows are
+    fetched concurrently, at most FETCH_WORKERS at a time, and yielded in order.
+    Follow-up pages are queued ahead of new reports so started departments finish first.
+    """
+    if first_response is None:
+        first_response = cached_run_report(client, page_request(request, 0))
+    yield from first_response.rows
+    offsets = range(len(first_response.rows), first_response.row_count, ROW_LIMIT)
+    if not first_response.rows or not offsets:
+        return
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        pages = pool.map(
+            lambda offset: cached_run_report(client, page_request(request, offset), PRIORITY_CONTINUATION),
+            offsets,
+        )
+        for resp in pages:
+            yield from resp.rows
+
+def fetch_analytics_data(client, dept_path, start_date, end_date, property_id):
+    """Fetch every analytics row for a department as a generator"""
+    request = build_page_report_request(property_id, start_date, end_date, page_filter(dept_path))
+    return run_report_paginated(client, request)
+
+def fetch_total_site_views(client, start_date, end_date, property_id):
+    """Fetch total site views for percentage calculation, reusing a cached total when possible"""
+    key = (property_id, start_date, end_date)
+    total_site_views = site_total_cache.get(key)
+    if total_site_views is None:
+        resp = cached_run_report(client, build_site_total_request(property_id, start_date, end_date))
+        total_site_views = parse_total_site_views(resp)
+        site_total_cache.set(key, total_site_views)
+    return total_site_views
+
+def batch_run_reports(client, property_id, requests):
+    """Run reports through batchRunReports, BATCH_SIZE per call, keeping request order.
+
+    Requests already in the response cache are answered locally and left out of the batches.
+    """
+    keys = [request_fingerprint(request) for request in requests]
+    responses = [None] * len(requests)
+    pending = []
+    for idx, key in enumerate(keys):
+        cached = ga_response_cache.get(key)
+        if cached is not None:
+            responses[idx] = RunReportResponse.deserialize(cached)
+        else:
+            pending.append(idx)
+    for start in range(0, len(pending), BATCH_SIZE):
+        chunk = pending[start:start + BATCH_SIZE]
+        batch = BatchRunReportsRequest(
+            property="properties/" + property_id,
+            requests=[requests[idx] for idx in chunk],
+        )
+        for idx, resp in zip(chunk, quota_scheduler.batch_run_reports(client, batch).reports):
+            ga_response_cache.set(keys[idx], RunReportResponse.serialize(resp))
+            responses[idx] = resp
+    return responses
+
+def fetch_department_reports(client, dept_paths, start_date, end_date, property_id):
+    """Fetch each department's page rows and the site total in batched round-trips.
+
+    Returns a dict of department path to rows, plus the total site views.
+    """
+    dept_paths = list(dict.fromkeys(dept_paths))
+    page_requests = [
+        build_page_report_request(property_id, start_date, end_date, page_filter(dept_path))
+        for dept_path in dept_paths
+    ]
+    requests = [page_request(request, 0) for request in page_requests]
+    # Only ask for the site total if it is not already cached
+    total_key = (property_id, start_date, end_date)
+    total_site_views = site_total_cache.get(total_key)
+    if total_site_views is None:
+        requests.append(build_site_total_request(property_id, start_date, end_date))
+    responses = batch_run_reports(client, property_id, requests)
+    if total_site_views is None:
+        total_site_views = parse_total_site_views(responses[-1])
+        site_total_cache.set(total_key, total_site_views)
+    # Batched responses hold the first page; departments with more rows fetch the rest
+    dept_rows = {
+        dept_path: list(run_report_paginated(client, request, first_response=resp))
+        for dept_path, request, resp in zip(dept_paths, page_requests, responses)
+    }
+    return dept_rows, total_site_views
+
+async def cached_run_report_async(client, request, priority=PRIORITY_DEFAULT):
+    """Async counterpart of cached_run_report for BetaAnalyticsDataAsyncClient"""
+    key = request_fingerprint(request)
+    cached = ga_response_cache.get(key)
+    if cached is not None:
+        return RunReportResponse.deserialize(cached)
+    resp = await quota_scheduler.run_report_async(client, request, priority)
+    ga_response_cache.set(key, RunReportResponse.serialize(resp))
+    return resp
+
+async def run_report_paginated_async(client, request):
+    """Async counterpart of run_report_paginated that returns every row as a list"""
+    first_response = await cached_run_report_async(client, page_request(request, 0))
+    rows = list(first_response.rows)
+    offsets = range(len(rows), first_response.row_count, ROW_LIMIT)
+    if not rows or not offsets:
+        return rows
+    semaphore = asyncio.Semaphore(FETCH_WORKERS)
+
+    async def fetch_page(offset):
+        async with semaphore:
+            return await cached_run_report_async(client, page_request(request, offset), PRIORITY_CONTINUATION)
+
+    for resp in await asyncio.gather(*(fetch_page(offset) for offset in offsets)):
+        rows.extend(resp.rows)
+    return rows
+
+async def fetch_analytics_data_async(client, dept_path, start_date, end_date, property_id):
+    """Fetch every analytics row for a department with an async client"""
+    request = build_page_report_request(property_id, start_date, end_date, page_filter(dept_path))
+    return await run_report_paginated_async(client, request)
+
+async def fetch_total_site_views_async(client, start_date, end_date, property_id):
+    """Fetch total site views with an async client, reusing a cached total when possible"""
+    key = (property_id, start_date, end_date)
+    total_site_views = site_total_cache.get(key)
+    if total_site_views is None:
+        resp = await cached_run_report_async(client, build_site_total_request(property_id, start_date, end_date))
+        total_site_views = parse_total_site_views(resp)
+        site_total_cache.set(key, total_site_views)
+    return total_site_views
+
+def fetch_site_rows(client, start_date, end_date, property_id):
+    """Fetch every pagePath/pageTitle row for the property in one paginated report"""
+    request = build_page_report_request(property_id, start_date, end_date, page_filter())
+    return run_report_paginated(client, request)
+
+class DepartmentTrie:
+    """Character trie of normalized department paths.
+
+    Matching mirrors GA's case-insensitive BEGINS_WITH filter, so a row is
+    assigned to every requested department whose path prefixes it.
+    """
+
+    _END = object()
+
+    def __init__(self, dept_paths):
+        self._root = {}
+        for dept_path in dept_paths:
+            node = self._root
+            for char in dept_path.lower():
+                node = node.setdefault(char, {})
+            node.setdefault(self._END, []).append(dept_path)
+
+    def match(self, path):
+        """Return every department path that is a prefix of path"""
+        matches = []
+        node = self._root
+        for char in path.lower():
+            node = node.get(char)
+            if node is None:
+                break
+            if self._END in node:
+                matches.extend(node[self._END])
+        return matches
+
+def partition_rows(rows, dept_paths):
+    """Split site-wide report rows into per-department row lists"""
+    dept_paths = list(dict.fromkeys(dept_paths))
+    trie = DepartmentTrie(dept_paths)
+    partitions = {dept_path: [] for dept_path in dept_paths}
+    # Paths repeat once per title variant, so only walk the trie once per path
+    matches_by_path = {}
+    for row in rows:
+        raw_path = row.dimension_values[0].value
+        matches = matches_by_path.get(raw_path)
+        if matches is None:
+            matches = matches_by_path[raw_path] = trie.match(raw_path)
+        for dept_path in matches:
+            partitions[dept_path].append(row)
+    return partitions
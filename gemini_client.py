@@ -0,0 +1,184 @@
+"""
+Shared HTTP client for Gemini calls.
+
+One requests.Session keeps a pool of keep-alive connections for every
+department. Each call gets a timeout capped by the caller's deadline, 429 and
+5xx replies are retried with jittered exponential backoff, and a circuit
+breaker stops calling Gemini for a while after repeated failures so a batch
+doesn't wait out the full timeout once per department.
+"""
+
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import asyncio
+import httpx
+import os
+import random
+import requests
+import threading
+import time
+
+# Load environment variables
+load_dotenv()
+
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '60'))
+GEMINI_POOL_SIZE = int(os.getenv('GEMINI_POOL_SIZE', '8'))
+GEMINI_RETRIES = int(os.getenv('GEMINI_RETRIES', '2'))
+GEMINI_BACKOFF = float(os.getenv('GEMINI_BACKOFF', '1.0'))
+# Consecutive failed calls that open the breaker, and seconds before it lets a trial call through
+GEMINI_BREAKER_THRESHOLD = int(os.getenv('GEMINI_BREAKER_THRESHOLD', '3'))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv('GEMINI_BREAKER_COOLDOWN', '300'))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# A call isn't started (or retried) with less time than this left before the deadline
+MIN_CALL_TIMEOUT = 2.0
+
+class GeminiUnavailable(Exception):
+    """Raised instead of calling Gemini when the breaker is open or the deadline has passed"""
+
+def deadline_after(seconds):
+    """time.monotonic() deadline seconds from now, or None for no budget"""
+    return time.monotonic() + seconds if seconds and seconds > 0 else None
+
+class CircuitBreaker:
+    """Opens after threshold consecutive failures; after cooldown seconds one trial call may go through"""
+
+    def __init__(self, threshold=GEMINI_BREAKER_THRESHOLD, cooldown=GEMINI_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold or self._trial:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self):
+        """End a trial call that was abandoned without an outcome"""
+        with self._lock:
+            self._trial = False
+
+def retry_after(response):
+    """Seconds asked for in a Retry-After header, if any"""
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+class GeminiClient:
+    """Pooled Gemini caller with deadlines, retries and a circuit breaker"""
+
+    def __init__(self, timeout=GEMINI_TIMEOUT, retries=GEMINI_RETRIES, backoff=GEMINI_BACKOFF,
+                 pool_size=GEMINI_POOL_SIZE, breaker=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def _call_timeout(self, deadline):
+        """Timeout for the next attempt, raising GeminiUnavailable if the budget is spent"""
+        timeout = self.timeout if deadline is None else min(self.timeout, deadline - time.monotonic())
+        if timeout < MIN_CALL_TIMEOUT:
+            self.breaker.release()
+            raise GeminiUnavailable("request time budget exhausted")
+        return timeout
+
+    def _retry_delay(self, attempt, response, deadline):
+        """Seconds to wait before retrying, or None to give up"""
+        if attempt >= self.retries:
+            return None
+        delay = retry_after(response)
+        if delay is None:
+            # Full jitter keeps departments that failed together from retrying together
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+        if deadline is not None and time.monotonic() + delay + MIN_CALL_TIMEOUT > deadline:
+            return None
+        return delay
+
+    def _before_call(self):
+        if not self.breaker.allow():
+            raise GeminiUnavailable("Gemini circuit breaker is open after repeated failures")
+
+    def _outcome(self, response):
+        """Record a final response with the breaker and return it"""
+        if response.status_code in RETRY_STATUSES:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def post(self, url, payload, deadline=None):
+        """POST payload, retrying 429/5xx and connection errors; returns the last response"""
+        self._before_call()
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(url, json=payload, timeout=self._call_timeout(deadline))
+                error = None
+            except requests.RequestException as e:
+                response, error = None, e
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                return self._outcome(response)
+            delay = self._retry_delay(attempt, response, deadline)
+            if delay is None:
+                if error is not None:
+                    self.breaker.record_failure()
+                    raise error
+                return self._outcome(response)
+            time.sleep(delay)
+            attempt += 1
+
+    async def post_async(self, http_client, url, payload, deadline=None):
+        """post() through an httpx.AsyncClient, sharing this client's breaker and retry policy"""
+        self._before_call()
+        attempt = 0
+        while True:
+            try:
+                response = await http_client.post(url, json=payload, timeout=self._call_timeout(deadline))
+                error = None
+            except httpx.HTTPError as e:
+                response, error = None, e
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                return self._outcome(response)
+            delay = self._retry_delay(attempt, response, deadline)
+            if delay is None:
+                if error is not None:
+                    self.breaker.record_failure()
+                    raise error
+                return self._outcome(response)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        return {"breaker": self.breaker.state, "consecutive_failures": self.breaker.failures}
+
+gemini_client = GeminiClient()
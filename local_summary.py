@@ -0,0 +1,123 @@
+"""
+Offline Summary sheet text, built from the report data without any network call.
+
+The WHAT'S WORKING / WHAT'S NOT WORKING / RECOMMENDATIONS sections are derived
+from the department's summary statistics, how many pages (and how much of the
+traffic) each review rule flags, and per-term statistics over the page titles,
+which stand in for the content themes Gemini would pick out. It takes a few
+milliseconds, so it can be chosen per run and fills in whenever Gemini can't.
+"""
+
+from review_rules import REVIEW_RULES, rule_masks
+from dotenv import load_dotenv
+import numpy as np
+import os
+
+# Load environment variables
+load_dotenv()
+
+# Title terms reported as strong or weak themes, and pages a term needs to count as a theme
+LOCAL_SUMMARY_THEMES = int(os.getenv('LOCAL_SUMMARY_THEMES', '3'))
+LOCAL_SUMMARY_MIN_PAGES = int(os.getenv('LOCAL_SUMMARY_MIN_PAGES', '3'))
+
+# Terms on more than this share of titles (site or department names) don't tell themes apart
+COMMON_TERM_SHARE = 0.5
+# A theme is strong or weak when its pages average this many times more, or fewer, views than the section
+THEME_RATIO = 1.25
+
+TERM_PATTERN = r"[a-z][a-z0-9'-]{2,}"
+
+STOP_WORDS = frozenset("""
+    the and for with from into about your our you are was were will can how what when where who why
+    this that these those its not but all any has have had more most other some such than then
+    page pages home welcome index untitled
+""".split())
+
+def title_terms(grouped_data, min_pages=LOCAL_SUMMARY_MIN_PAGES):
+    """Pages, mean views and mean bounce rate per title term found on at least min_pages pages"""
+    titles = grouped_data["Page Title"].fillna("").astype(str).str.lower()
+    # Each term counts once per page, however often the title repeats it
+    terms = titles.str.findall(TERM_PATTERN).map(lambda found: list(dict.fromkeys(found)))
+    exploded = grouped_data[["Views", "Bounce Rate (%)"]].assign(Term=terms).explode("Term").dropna(subset=["Term"])
+    exploded = exploded[~exploded["Term"].isin(STOP_WORDS)]
+    stats = exploded.groupby("Term").agg(
+        Pages=("Views", "size"),
+        Views=("Views", "mean"),
+        Bounce=("Bounce Rate (%)", "mean"),
+    )
+    stats = stats[(stats["Pages"] >= min_pages) & (stats["Pages"] <= COMMON_TERM_SHARE * len(grouped_data))]
+    # Terms that always appear together ("undergraduate admissions") are reported as one theme
+    return stats.reset_index().groupby(["Pages", "Views", "Bounce"], sort=False)["Term"].agg("/".join).reset_index().set_index("Term")
+
+def rule_findings(grouped_data, masks, rules=REVIEW_RULES):
+    """(rule, pages flagged, share of the section's views on them) for every rule that matches a page"""
+    views = grouped_data["Views"].to_numpy()
+    total_views = views.sum()
+    findings = []
+    for rule, mask in zip(rules, masks):
+        flagged = int(mask.sum())
+        if flagged:
+            findings.append((rule, flagged, views[mask].sum() / total_views * 100 if total_views else 0.0))
+    return sorted(findings, key=lambda finding: -finding[1])
+
+def describe_term(term, stats, average_views):
+    ratio = stats["Views"] / average_views if average_views else 0.0
+    compared = f"{ratio:.1f}x the section average" if ratio >= 1 else f"{ratio:.0%} of the section average"
+    return (f"Pages about \"{term}\" ({stats['Pages']:.0f} pages) average {stats['Views']:,.1f} views, "
+            f"{compared}, with a {stats['Bounce']:.1f}% bounce rate.")
+
+def quote_terms(terms):
+    return ", ".join(f"\"{term}\"" for term in terms)
+
+def list_titles(pages):
+    return ", ".join(f"{page['Page Title']} ({page['Views']:,} views)" for page in pages)
+
+def local_summary(grouped_data, section_traffic_percentage, overall_stats):
+    """Summary sheet text for a department, computed locally from its report data"""
+    total_pages = overall_stats["total_pages"]
+    if not total_pages:
+        return "WHAT'S WORKING\n- No pages with data.\n\nWHAT'S NOT WORKING\n- No pages with data.\n\nRECOMMENDATIONS\n- Check that the department URL and date range are correct."
+
+    average_views = overall_stats["average_views"]
+    terms = title_terms(grouped_data)
+    strong = terms[terms["Views"] >= average_views * THEME_RATIO].nlargest(LOCAL_SUMMARY_THEMES, "Views")
+    weak = terms[terms["Views"] <= average_views / THEME_RATIO].nsmallest(LOCAL_SUMMARY_THEMES, "Views")
+    masks = rule_masks(grouped_data)
+    findings = rule_findings(grouped_data, masks)
+    flagged = int(np.logical_or.reduce(masks).sum()) if masks else 0
+
+    working = [
+        f"This section accounts for {section_traffic_percentage}% of all tracked site traffic, "
+        f"with {overall_stats['total_views']:,} views across {total_pages:,} pages "
+        f"({average_views:,.1f} views and {overall_stats['average_users']:,.1f} users per page on average).",
+    ]
+    if overall_stats["top_5_pages"]:
+        working.append(f"Most viewed pages: {list_titles(overall_stats['top_5_pages'])}.")
+    working += [describe_term(term, stats, average_views) for term, stats in strong.iterrows()]
+    working.append(f"{total_pages - flagged:,} of {total_pages:,} pages ({(total_pages - flagged) / total_pages * 100:.0f}%) "
+                   f"meet none of the review rules.")
+
+    not_working = [
+        f"{rule['reason']}: {count:,} pages ({count / total_pages * 100:.0f}% of the section), "
+        f"drawing {views_share:.1f}% of its views."
+        for rule, count, views_share in findings
+    ]
+    not_working += [describe_term(term, stats, average_views) for term, stats in weak.iterrows()]
+    not_working.append(f"{overall_stats['pages_with_low_views']:,} pages have fewer than 10 views and "
+                       f"{overall_stats['pages_with_high_bounce']:,} have a bounce rate above 80% "
+                       f"(section average {overall_stats['average_bounce_rate']:.1f}%).")
+    if overall_stats["bottom_5_pages"]:
+        not_working.append(f"Least viewed pages: {list_titles(overall_stats['bottom_5_pages'])}.")
+
+    recommendations = [f"{rule['reason']} ({count:,} pages): {rule['action']}" for rule, count, _ in findings]
+    if len(strong) and len(weak):
+        recommendations.append(
+            f"Link pages about {quote_terms(weak.index)} from the better-performing {quote_terms(strong.index)} pages, "
+            f"or merge them into those pages where the topics overlap."
+        )
+    if not findings:
+        recommendations.append("No pages meet the review rules; keep the current structure and re-run the report to track changes.")
+    recommendations.append("Review the 'Pages to Review' tab for the individual pages behind these figures.")
+
+    sections = [("WHAT'S WORKING", working), ("WHAT'S NOT WORKING", not_working), ("RECOMMENDATIONS", recommendations)]
+    return "\n\n".join(heading + "\n" + "\n".join(f"- {line}" for line in lines) for heading, lines in sections)
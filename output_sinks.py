@@ -0,0 +1,114 @@
+"""
+Output sinks that write a department's report sheets in one file format.
+
+The Excel sink writes every sheet to one formatted workbook. The CSV, NDJSON
+and Parquet sinks only write the data sheets downstream tools read ("All
+Pages" and "Pages to Review"), one file per sheet, and need no AI summary, so
+the Gemini call can be skipped for them.
+"""
+
+from excel_writer import write_workbook
+from dotenv import load_dotenv
+import importlib.util
+import os
+
+# Load environment variables
+load_dotenv()
+
+# Format used when a run doesn't pick one
+OUTPUT_FORMAT = os.getenv('OUTPUT_FORMAT', 'xlsx').lower()
+
+# Sheets written by the table formats, with the suffix added to their file names
+TABLE_SHEETS = [("All Pages", "all_pages"), ("Pages to Review", "pages_to_review")]
+
+class ReportSink:
+    """Writes report sheets, given as (title, DataFrame) pairs, to one or more files"""
+
+    name = None
+    label = None
+    extension = None
+    needs_summary = False
+
+    def available(self):
+        return True
+
+    def filenames(self, filename):
+        """Files written for a report named filename, in the order write() expects targets"""
+        return [os.path.splitext(filename)[0] + self.extension]
+
+    def write(self, targets, sheets):
+        """Write sheets to targets, paths or binary file objects matching filenames()"""
+        raise NotImplementedError
+
+class ExcelSink(ReportSink):
+    name = "xlsx"
+    label = "Excel workbook"
+    extension = ".xlsx"
+    needs_summary = True
+
+    def write(self, targets, sheets):
+        write_workbook(targets[0], sheets, wrap_sheets=("Summary",))
+
+class TableSink(ReportSink):
+    """One plain data file per sheet in TABLE_SHEETS"""
+
+    def filenames(self, filename):
+        stem = os.path.splitext(filename)[0]
+        return [f"{stem}_{suffix}{self.extension}" for _, suffix in TABLE_SHEETS]
+
+    def write(self, targets, sheets):
+        frames = dict(sheets)
+        for target, (title, _) in zip(targets, TABLE_SHEETS):
+            self.write_table(target, frames[title])
+
+    def write_table(self, target, df):
+        raise NotImplementedError
+
+class CsvSink(TableSink):
+    name = "csv"
+    label = "CSV"
+    extension = ".csv"
+
+    def write_table(self, target, df):
+        df.to_csv(target, index=False, encoding="utf-8")
+
+class NdjsonSink(TableSink):
+    name = "ndjson"
+    label = "NDJSON"
+    extension = ".ndjson"
+
+    def write_table(self, target, df):
+        if df.empty:
+            # pandas writes a lone newline for an empty frame, which isn't a valid record
+            if isinstance(target, str):
+                open(target, "wb").close()
+            return
+        df.to_json(target, orient="records", lines=True, force_ascii=False, double_precision=15)
+
+class ParquetSink(TableSink):
+    name = "parquet"
+    label = "Parquet"
+    extension = ".parquet"
+
+    def available(self):
+        # pandas needs pyarrow or fastparquet to write Parquet; neither is a hard requirement
+        return any(importlib.util.find_spec(engine) for engine in ("pyarrow", "fastparquet"))
+
+    def write_table(self, target, df):
+        df.to_parquet(target, index=False)
+
+SINKS = {sink.name: sink for sink in (ExcelSink(), CsvSink(), NdjsonSink(), ParquetSink())}
+
+def available_sinks():
+    """Sinks that can be written here, by name, for the format choices offered to users"""
+    return {name: sink for name, sink in SINKS.items() if sink.available()}
+
+def get_sink(name=None):
+    """The sink for a format name, raising ValueError if it is unknown or can't be written here"""
+    name = (name or OUTPUT_FORMAT).lower()
+    sink = SINKS.get(name)
+    if sink is None:
+        raise ValueError(f"Unknown output format '{name}', expected one of: {', '.join(SINKS)}")
+    if not sink.available():
+        raise ValueError(f"{sink.label} output needs pyarrow or fastparquet installed")
+    return sink
@@ -0,0 +1,92 @@
+"""
+Single-pass aggregation of processed rows into one row per page.
+
+The normalized path is factorized once and rows are sorted by page. Integer
+sums are reduced with np.add.reduceat, float sums with a vectorized Kahan
+summation that matches pandas, and the derived ratios are masked vector
+divisions instead of row-wise apply calls.
+"""
+
+from row_decoder import round_values
+import numpy as np
+import pandas as pd
+
+PAGE_COLUMNS = ["URL", "Page Title", "Views", "Users", "Bounce Rate (%)", "Event Count", "Views per User", "Engagement Time Per View"]
+
+# Below this many pages still being summed, the remaining rows are added in plain Python
+VECTOR_MIN_GROUPS = 16
+
+def compensated_sums(values, order, starts, counts):
+    """Kahan-summed total of values per page, adding rows in their original order.
+
+    This is the summation pandas' groupby sum and mean use, so totals match
+    the previous groupby results bit for bit. Step k adds the k-th row of every
+    page that has one, so the loop runs once per row of the largest page.
+    """
+    values = values[order].astype(np.float64)
+    sums = np.zeros(len(counts), dtype=np.float64)
+    compensation = np.zeros(len(counts), dtype=np.float64)
+    # Pages by descending size, so the pages with a k-th row are a prefix
+    by_size = np.argsort(-counts, kind="stable")
+    active_counts = np.cumsum(np.bincount(counts)[::-1])[::-1]
+    step = 0
+    max_count = int(counts.max())
+    while step < max_count and active_counts[step + 1] >= VECTOR_MIN_GROUPS:
+        active = by_size[:active_counts[step + 1]]
+        y = values[starts[active] + step] - compensation[active]
+        t = sums[active] + y
+        compensation[active] = np.nan_to_num((t - sums[active]) - y, nan=0.0, posinf=0.0, neginf=0.0)
+        sums[active] = t
+        step += 1
+    if step < max_count:
+        for page in by_size[:active_counts[step + 1]]:
+            total, carry = sums[page], compensation[page]
+            for value in values[starts[page] + step:starts[page] + counts[page]].tolist():
+                y = value - carry
+                t = total + y
+                carry = (t - total) - y
+                if carry != carry:
+                    carry = 0.0
+                total = t
+            sums[page] = total
+    return sums
+
+def ratio(numerator, denominator):
+    """numerator / denominator rounded to 2 places, 0 where the denominator is 0"""
+    result = np.zeros(len(numerator), dtype=np.float64)
+    np.divide(numerator, denominator, out=result, where=denominator != 0)
+    return round_values(result, 2)
+
+def aggregate_pages(df):
+    """Group rows by normalized path and add Views per User and Engagement Time Per View.
+
+    Matches df.groupby(["Normalized Path", "URL"]).agg(...) with "first" for the
+    title, sums for counts and engagement, and the mean bounce rate; pages come
+    out sorted by path.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=PAGE_COLUMNS)
+    codes, _ = pd.factorize(df["Normalized Path"].to_numpy(), sort=True)
+    counts = np.bincount(codes)
+    # Rows ordered by page, keeping their original order within a page
+    order = np.argsort(codes, kind="stable")
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    first = order[starts]
+
+    def total(column):
+        return np.add.reduceat(df[column].to_numpy()[order], starts)
+
+    views = total("Views")
+    users = total("Users")
+    engagement = compensated_sums(df["Engagement Time (sec)"].to_numpy(), order, starts, counts)
+    bounce_rate = compensated_sums(df["Bounce Rate (%)"].to_numpy(), order, starts, counts) / counts
+    return pd.DataFrame({
+        "URL": df["URL"].to_numpy()[first],
+        "Page Title": df["Page Title"].to_numpy()[first],
+        "Views": views,
+        "Users": users,
+        "Bounce Rate (%)": bounce_rate,
+        "Event Count": total("Event Count"),
+        "Views per User": ratio(views, users),
+        "Engagement Time Per View": ratio(engagement, views),
+    }, copy=False)
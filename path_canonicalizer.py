@@ -0,0 +1,110 @@
+"""
+Canonical page paths for grouping report rows.
+
+Rules are compiled once and applied to whole pandas string columns. Raw to
+canonical mappings are kept in a bounded LRU memo shared by every department
+processed in the same run, so repeated paths are only rewritten once.
+"""
+
+from collections import OrderedDict
+from dotenv import load_dotenv
+import numpy as np
+import os
+import pandas as pd
+import re
+import threading
+
+# Load environment variables
+load_dotenv()
+
+# Rules in the order they are applied; PATH_RULES picks which ones are enabled
+RULE_ORDER = ["query_fragment", "case_fold", "duplicate_slashes", "index_files", "trailing_slash"]
+DEFAULT_RULES = "duplicate_slashes,index_files,trailing_slash"
+PATH_RULES = [rule.strip() for rule in os.getenv('PATH_RULES', DEFAULT_RULES).split(',') if rule.strip()]
+# File names that serve a directory, stripped from the end of a path
+PATH_INDEX_FILES = [name.strip() for name in os.getenv('PATH_INDEX_FILES', 'index.html').split(',') if name.strip()]
+PATH_MEMO_SIZE = int(os.getenv('PATH_MEMO_SIZE', '200000'))
+
+def compile_rules(rules, index_files):
+    """Compile enabled rules into (pattern, replacement) steps; None as the pattern means lowercase"""
+    unknown = set(rules) - set(RULE_ORDER)
+    if unknown:
+        raise ValueError(f"Unknown path rules: {', '.join(sorted(unknown))}")
+    steps = []
+    for rule in RULE_ORDER:
+        if rule not in rules:
+            continue
+        if rule == "query_fragment":
+            steps.append((re.compile(r"[?#].*", re.DOTALL), ""))
+        elif rule == "case_fold":
+            steps.append((None, None))
+        elif rule == "duplicate_slashes":
+            steps.append((re.compile(r"//+"), "/"))
+        elif rule == "index_files" and index_files:
+            names = "|".join(re.escape(name) for name in index_files)
+            steps.append((re.compile(rf"(\/)?(?:{names})$", re.IGNORECASE), ""))
+        elif rule == "trailing_slash":
+            steps.append((re.compile(r"(?<!/)\Z"), "/"))
+    return steps
+
+class PathCanonicalizer:
+    """Applies the compiled path rules, remembering up to memo_size raw paths"""
+
+    def __init__(self, rules=PATH_RULES, index_files=PATH_INDEX_FILES, memo_size=PATH_MEMO_SIZE):
+        self.steps = compile_rules(rules, index_files)
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _rewrite(self, path):
+        for pattern, replacement in self.steps:
+            path = path.lower() if pattern is None else pattern.sub(replacement, path)
+        return path
+
+    def _rewrite_series(self, paths):
+        for pattern, replacement in self.steps:
+            paths = paths.str.lower() if pattern is None else paths.str.replace(pattern, replacement, regex=True)
+        return paths
+
+    def _remember(self, pairs):
+        with self._lock:
+            self._memo.update(pairs)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def canonicalize(self, path):
+        """Canonical form of a single path"""
+        with self._lock:
+            canonical = self._memo.get(path)
+            if canonical is not None:
+                self._memo.move_to_end(path)
+                return canonical
+        canonical = self._rewrite(path)
+        self._remember([(path, canonical)])
+        return canonical
+
+    def canonicalize_many(self, paths):
+        """Canonical forms of an array of paths, rewriting each distinct uncached path once"""
+        codes, uniques = pd.factorize(np.asarray(paths, dtype=object))
+        canonical = np.empty(len(uniques), dtype=object)
+        missing = []
+        with self._lock:
+            for idx, path in enumerate(uniques):
+                cached = self._memo.get(path)
+                if cached is None:
+                    missing.append(idx)
+                else:
+                    self._memo.move_to_end(path)
+                    canonical[idx] = cached
+        if missing:
+            rewritten = self._rewrite_series(pd.Series(uniques[missing], dtype=object)).to_numpy(dtype=object)
+            canonical[missing] = rewritten
+            self._remember(zip(uniques[missing], rewritten))
+        return canonical[codes]
+
+    def clear(self):
+        with self._lock:
+            self._memo.clear()
+
+# Shared by every department in the process
+path_canonicalizer = PathCanonicalizer()
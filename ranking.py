@@ -0,0 +1,73 @@
+"""
+Top-K / bottom-K page selection without sorting the whole frame.
+
+One np.partition call finds both cut-off values, the rows on the right side
+of each cut-off are picked with vector comparisons, and only those K rows are
+sorted. Ties keep the pages' original order, as a stable sort would.
+"""
+
+from dotenv import load_dotenv
+import numpy as np
+import os
+
+# Load environment variables
+load_dotenv()
+
+# Rows on the top pages sheet, and pages listed in each summary top/bottom list
+TOP_PAGES = int(os.getenv('TOP_PAGES', '20'))
+SUMMARY_PAGES = int(os.getenv('SUMMARY_PAGES', '5'))
+
+def parse_top_pages(value):
+    """Top pages count from a request value, raising ValueError unless it is a positive integer"""
+    if isinstance(value, str) and value.strip().isascii() and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError(f"topPages must be a positive integer, got {value!r}")
+    return value
+
+def _select(values, threshold, k, beyond):
+    """Positions of the k values beyond threshold, filling up with ties in original order"""
+    chosen = np.flatnonzero(beyond)
+    ties = np.flatnonzero(values == threshold)[:k - len(chosen)]
+    return np.concatenate((chosen, ties))
+
+def rank_positions(values, top=0, bottom=0):
+    """Positions of the top largest and bottom smallest values, each in ranked order"""
+    values = np.asarray(values)
+    n = len(values)
+    top, bottom = min(top, n), min(bottom, n)
+    # Cut-off for the top list is the top-th largest value, for the bottom list the bottom-th smallest
+    kth = ([n - top] if top else []) + ([bottom - 1] if bottom else [])
+    partitioned = np.partition(values, kth) if kth else values
+    positions = np.arange(n)
+    top_positions = bottom_positions = positions[:0]
+    if top:
+        threshold = partitioned[n - top]
+        chosen = _select(values, threshold, top, values > threshold)
+        top_positions = chosen[np.lexsort((chosen, -values[chosen]))]
+    if bottom:
+        threshold = partitioned[bottom - 1]
+        chosen = _select(values, threshold, bottom, values < threshold)
+        bottom_positions = chosen[np.lexsort((chosen, values[chosen]))]
+    return top_positions, bottom_positions
+
+class PageRanking:
+    """Top and bottom pages of a grouped frame by one column, ranked in a single pass.
+
+    Ask for the largest K needed up front; smaller lists are prefixes of it.
+    """
+
+    def __init__(self, grouped_data, top=0, bottom=0, column="Views"):
+        self.grouped_data = grouped_data
+        self._top, self._bottom = rank_positions(grouped_data[column].to_numpy(), top, bottom)
+        self._top_k, self._bottom_k = top, bottom
+
+    def top(self, k):
+        if k > self._top_k:
+            raise ValueError(f"Ranking holds the top {self._top_k} pages, not {k}")
+        return self.grouped_data.iloc[self._top[:k]]
+
+    def bottom(self, k):
+        if k > self._bottom_k:
+            raise ValueError(f"Ranking holds the bottom {self._bottom_k} pages, not {k}")
+        return self.grouped_data.iloc[self._bottom[:k]]
@@ -0,0 +1,174 @@
+"""
+Process-pool rendering stage for multi-department batches.
+
+Building a workbook is CPU-bound pure Python, so with several departments the
+report files are rendered in worker processes instead of one after another on
+a single core. Sheets are sent to the workers column by column (as Arrow IPC
+when pyarrow is installed, otherwise as plain NumPy column arrays) rather than
+as pickled DataFrames, and files for in-memory targets come back as bytes.
+A report whose AI summary is still being generated is handed to a worker once
+the summary is done, so departments never wait on Gemini one after another.
+"""
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from excel_writer import DeferredSheet
+from output_sinks import SINKS
+from dotenv import load_dotenv
+import io
+import multiprocessing
+import os
+import threading
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Load environment variables
+load_dotenv()
+
+# Worker processes for rendering report files; 0 or 1 renders them in the calling process.
+# Each worker imports pandas, openpyxl and pyarrow, and containers often report the host's
+# CPU count, so the default is capped
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+def pack_frame(df):
+    """Compact, columnar form of df to send to a worker process"""
+    if pa is not None:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return ("arrow", sink.getvalue().to_pybytes())
+    return ("columns", list(df.columns), [df[name].to_numpy() for name in df.columns])
+
+def unpack_frame(packed):
+    """DataFrame from pack_frame output"""
+    if packed[0] == "arrow":
+        return pa.ipc.open_stream(packed[1]).read_all().to_pandas()
+    _, columns, arrays = packed
+    return pd.DataFrame(dict(zip(columns, arrays)), columns=columns)
+
+def render_report(sink_name, targets, sheets):
+    """Worker entry point: write packed sheets with the named sink.
+
+    Path targets are written in place; None targets are rendered in memory
+    and their bytes returned in the same position.
+    """
+    frames = [(title, unpack_frame(packed)) for title, packed in sheets]
+    outputs = [io.BytesIO() if target is None else target for target in targets]
+    SINKS[sink_name].write(outputs, frames)
+    return [output.getvalue() if target is None else None for target, output in zip(targets, outputs)]
+
+class PendingRender(Future):
+    """Render of a report that is submitted once its DeferredSheet Futures are done.
+
+    Waiting for it waits for those Futures first, so a summary still queued
+    in an ai_batch.SummaryBatcher is sent rather than waited on forever.
+    """
+
+    def __init__(self, waiting_on):
+        super().__init__()
+        self.waiting_on = waiting_on
+
+    def result(self, timeout=None):
+        for future in self.waiting_on:
+            try:
+                future.result(timeout)
+            except TimeoutError:
+                raise
+            except Exception:
+                # The failure reaches this render through the callback that builds the sheet
+                pass
+        return super().result(timeout)
+
+def chain(source, target):
+    """Resolve target with source's outcome once source is done"""
+    def copy(done):
+        if done.exception() is not None:
+            target.set_exception(done.exception())
+        else:
+            target.set_result(done.result())
+    source.add_done_callback(copy)
+
+class RenderPool:
+    """Renders report files in worker processes and collects the results"""
+
+    def __init__(self, workers=RENDER_WORKERS):
+        # Workers are spawned rather than forked so they don't inherit gRPC or HTTP client threads
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, sink, targets, sheets):
+        """Start rendering sheets to targets, paths or binary file objects; returns a Future.
+
+        Data sheets are packed right away. DeferredSheets (the AI summary) are
+        packed once their Futures are done, and only then does the report go
+        to a worker, so the calling thread doesn't wait for them.
+        """
+        paths = [target if isinstance(target, str) else None for target in targets]
+        deferred = [index for index, (_, df) in enumerate(sheets) if isinstance(df, DeferredSheet)]
+        packed = [(title, None if index in deferred else pack_frame(df() if callable(df) else df))
+                  for index, (title, df) in enumerate(sheets)]
+        if not deferred:
+            return self._executor.submit(render_report, sink.name, paths, packed)
+
+        render = PendingRender([sheets[index][1].future for index in deferred])
+        lock = threading.Lock()
+        waiting = set(deferred)
+
+        def sheet_ready(index):
+            with lock:
+                waiting.discard(index)
+                if waiting:
+                    return
+            try:
+                for position in deferred:
+                    title, sheet = sheets[position]
+                    packed[position] = (title, pack_frame(sheet()))
+                chain(self._executor.submit(render_report, sink.name, paths, packed), render)
+            except Exception as e:
+                render.set_exception(e)
+
+        for index in deferred:
+            sheets[index][1].future.add_done_callback(lambda _, index=index: sheet_ready(index))
+        return render
+
+    def collect(self, future, targets, label):
+        """Wait for a submitted report and fill in its file-object targets; True on success.
+
+        label names the report (its URL) in error messages.
+        """
+        try:
+            contents = future.result()
+        except Exception as e:
+            print(f"Error rendering report for {label}: {e!r}")
+            return False
+        for target, content in zip(targets, contents):
+            if content is not None:
+                target.write(content)
+        return True
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def get_render_pool():
+    """Shared RenderPool, or None when rendering should stay in this process.
+
+    That's the case with RENDER_WORKERS <= 1 or where worker processes can't
+    be started, e.g. serverless runtimes without shared-memory semaphores.
+    """
+    global _render_pool
+    if RENDER_WORKERS <= 1:
+        return None
+    with _render_pool_lock:
+        if _render_pool is None:
+            try:
+                _render_pool = RenderPool(RENDER_WORKERS)
+            except (OSError, NotImplementedError, ImportError) as e:
+                print(f"Process pool unavailable, rendering reports in-process: {e}")
+                _render_pool = False
+    return _render_pool or None
@@ -0,0 +1,128 @@
+"""
+In-memory report storage and streamed ZIP downloads.
+
+Reports are built in BytesIO buffers and kept here until they are downloaded,
+so nothing is written to the (often ephemeral) container filesystem. ZIP
+archives are produced chunk by chunk while the response is being sent, and
+files that are already compressed are stored instead of deflated again.
+"""
+
+from collections import OrderedDict, namedtuple
+from dotenv import load_dotenv
+import io
+import os
+import threading
+import time
+import uuid
+import zipfile
+
+# Load environment variables
+load_dotenv()
+
+# How long finished reports stay downloadable, and how many report sets and megabytes are kept at once
+REPORT_TTL = int(os.getenv('REPORT_TTL', '3600'))
+REPORT_STORE_SIZE = int(os.getenv('REPORT_STORE_SIZE', '32'))
+REPORT_STORE_MAX_MB = int(os.getenv('REPORT_STORE_MAX_MB', '256'))
+ZIP_CHUNK_SIZE = int(os.getenv('ZIP_CHUNK_SIZE', str(64 * 1024)))
+
+# .xlsx files are ZIP archives and Parquet pages are compressed, so deflating them again only costs CPU
+PRECOMPRESSED_EXTENSIONS = (".xlsx", ".parquet")
+
+StoredReports = namedtuple("StoredReports", ["files", "archive_name"])
+
+class ReportStore:
+    """Finished report files per download token, dropped after ttl seconds or when full.
+
+    The store is full with more than max_entries report sets or more than
+    max_bytes of files; the oldest sets are dropped first, but the newest one
+    is always kept so it can be downloaded.
+
+    Reports live in this process's memory, so downloads have to reach the
+    worker that built them (the default single gunicorn worker does).
+    """
+
+    def __init__(self, ttl=REPORT_TTL, max_entries=REPORT_STORE_SIZE, max_bytes=REPORT_STORE_MAX_MB * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._entries:
+            token, (created, size, _) = next(iter(self._entries.items()))
+            full = len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes
+            if now - created < self.ttl and not (full and len(self._entries) > 1):
+                break
+            del self._entries[token]
+            self.total_bytes -= size
+
+    def put(self, files, archive_name=None):
+        """Keep (filename, bytes) pairs and return their download token.
+
+        With archive_name set they are downloaded as one ZIP of that name,
+        otherwise the first file is downloaded on its own.
+        """
+        token = uuid.uuid4().hex
+        now = time.time()
+        files = list(files)
+        size = sum(len(data) for _, data in files)
+        with self._lock:
+            self._entries[token] = (now, size, StoredReports(files, archive_name))
+            self.total_bytes += size
+            self._expire(now)
+        return token
+
+    def get(self, token):
+        """The StoredReports for token, or None if it is unknown or expired"""
+        if not token:
+            return None
+        with self._lock:
+            self._expire(time.time())
+            entry = self._entries.get(token)
+        return entry[2] if entry else None
+
+class _ChunkBuffer(io.RawIOBase):
+    """Unseekable sink that collects what zipfile writes until it is drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def compression_for(filename):
+    return zipfile.ZIP_STORED if filename.lower().endswith(PRECOMPRESSED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+
+def stream_zip(files, chunk_size=ZIP_CHUNK_SIZE):
+    """Yield a ZIP archive of (filename, bytes) pairs piece by piece as it is built"""
+    sink = _ChunkBuffer()
+    # An unseekable sink makes zipfile write sizes and CRCs after each entry's data
+    with zipfile.ZipFile(sink, "w") as archive:
+        for filename, data in files:
+            info = zipfile.ZipInfo(filename, date_time=time.localtime()[:6])
+            info.compress_type = compression_for(filename)
+            info.external_attr = 0o600 << 16
+            info.file_size = len(data)
+            with archive.open(info, "w") as entry:
+                for start in range(0, len(data), chunk_size):
+                    entry.write(data[start:start + chunk_size])
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    yield sink.drain()
+
+report_store = ReportStore()
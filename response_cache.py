@@ -0,0 +1,182 @@
+"""
+Persistent SQLite response cache with per-entry TTL, a total size cap and LRU eviction.
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'page_inventory_cache')
+
+def fingerprint(data):
+    """Stable cache key for serialized request bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+class ResponseCache:
+    """Byte-valued cache stored in a single SQLite file.
+
+    Entries expire after ttl seconds. When the stored values exceed max_bytes,
+    the least recently read entries are evicted first. A ttl of 0 disables
+    the cache entirely. Expired entries are kept for another stale_ttl
+    seconds so lookup() can serve them while the caller refreshes them.
+    """
+
+    def __init__(self, path, ttl, max_bytes, stale_ttl=0):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._ready = False
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            conn.commit()
+            self._ready = True
+        return conn
+
+    def get(self, key):
+        """Return the cached bytes for key, or None on a miss"""
+        entry = self._read(key, allow_stale=False)
+        return entry[0] if entry else None
+
+    def lookup(self, key):
+        """Return (bytes, fresh) for key, or None on a miss.
+
+        Entries past their TTL but within stale_ttl come back with fresh=False.
+        """
+        return self._read(key, allow_stale=True)
+
+    def _read(self, key, allow_stale):
+        if not self.enabled:
+            return None
+        now = time.time()
+        oldest = now - self.stale_ttl if allow_stale else now
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] >= oldest:
+                    conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                    conn.commit()
+                    entry = (row[0], row[1] >= now)
+                else:
+                    entry = None
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Response cache read failed: {e}")
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            elif entry[1]:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+        return entry
+
+    def set(self, key, value, ttl=None):
+        """Store bytes under key, then evict expired and least recently used entries"""
+        if not self.enabled or len(value) > self.max_bytes:
+            return
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, sqlite3.Binary(value), len(value), expires_at, now),
+                )
+                evicted = self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Response cache write failed: {e}")
+            return
+        with self._lock:
+            self.evictions += evicted
+
+    def _evict(self, conn, now):
+        evicted = conn.execute("DELETE FROM entries WHERE expires_at < ?", (now - self.stale_ttl,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return evicted
+        stale_keys = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            stale_keys.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", stale_keys)
+        return evicted + len(stale_keys)
+
+    def clear(self):
+        if not os.path.exists(self.path):
+            return
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM entries")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Hit/miss counters and current size, for tuning TTL and size cap"""
+        entries, total_bytes = 0, 0
+        if self.enabled and os.path.exists(self.path):
+            try:
+                conn = self._connect()
+                try:
+                    entries, total_bytes = conn.execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+                    ).fetchone()
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"Response cache stats failed: {e}")
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "path": self.path,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+            }
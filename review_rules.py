@@ -0,0 +1,98 @@
+"""
+Declarative rules for the "Pages to Review" sheet.
+
+Each rule names a column, a comparator and a threshold, plus the reason and
+suggested action shown when a page matches. Rules are loaded once, evaluated
+as NumPy masks over the whole grouped frame, and the Reason / Suggested Action
+text is built once per distinct combination of matched rules.
+"""
+
+from dotenv import load_dotenv
+import json
+import numpy as np
+import os
+import pandas as pd
+
+# Load environment variables
+load_dotenv()
+
+COMPARATORS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+
+DEFAULT_REVIEW_RULES = [
+    {
+        "name": "low_views",
+        "column": "Views",
+        "comparator": "<=",
+        "threshold": int(os.getenv('LOW_VIEWS_THRESHOLD', '25')),
+        "reason": "Low page-views",
+        "action": "Remove the page if it's no longer needed, or • Improve its visibility: add links from high-traffic pages or menus.",
+    },
+    {
+        "name": "high_bounce_rate",
+        "column": "Bounce Rate (%)",
+        "comparator": ">=",
+        "threshold": float(os.getenv('HIGH_BOUNCE_RATE_THRESHOLD', '45.0')),
+        "reason": "High bounce rate",
+        "action": "Strengthen the \"first impression\": refine the page title, intro sentence, and hero image so they immediately match user intent.",
+    },
+    {
+        "name": "long_engagement",
+        "column": "Engagement Time Per View",
+        "comparator": ">",
+        "threshold": float(os.getenv('LONG_ENGAGEMENT_THRESHOLD', '60.0')),
+        "reason": "Avg. engagement > 60 s",
+        "action": "Tighten the page: focus on one topic, trim long sections, add clear sub-heads and bullets for quicker scanning.",
+    },
+]
+
+REVIEW_COLUMNS = ["Page Title", "URL", "Reason", "Suggested Action", "Views", "Users", "Bounce Rate (%)", "Engagement Time Per View", "Event Count", "Views per User"]
+
+def load_review_rules(path=None):
+    """Rules from the REVIEW_RULES_FILE JSON list if set, otherwise the defaults"""
+    path = path or os.getenv('REVIEW_RULES_FILE')
+    if not path:
+        return DEFAULT_REVIEW_RULES
+    with open(path, encoding='utf-8') as f:
+        rules = json.load(f)
+    for rule in rules:
+        missing = {"name", "column", "comparator", "threshold", "reason", "action"} - set(rule)
+        if missing:
+            raise ValueError(f"Review rule {rule.get('name', '?')} is missing {', '.join(sorted(missing))}")
+        if rule["comparator"] not in COMPARATORS:
+            raise ValueError(f"Review rule {rule['name']} has unknown comparator {rule['comparator']}")
+    return rules
+
+REVIEW_RULES = load_review_rules()
+
+def rule_masks(grouped_data, rules=REVIEW_RULES):
+    """One boolean mask per rule over the grouped pages"""
+    return [
+        COMPARATORS[rule["comparator"]](grouped_data[rule["column"]].to_numpy(), rule["threshold"])
+        for rule in rules
+    ]
+
+def pages_to_review(grouped_data, rules=REVIEW_RULES):
+    """Pages matching at least one rule, with the matched reasons and actions joined by " | " """
+    if grouped_data.empty or not rules:
+        return pd.DataFrame()
+    # Encode which rules matched as a bit pattern, then build the text once per pattern
+    matched = np.zeros(len(grouped_data), dtype=np.int64)
+    for bit, mask in enumerate(rule_masks(grouped_data, rules)):
+        matched |= mask.astype(np.int64) << bit
+    selected = matched > 0
+    if not selected.any():
+        return pd.DataFrame()
+    codes, patterns = pd.factorize(matched[selected])
+    reasons = np.array([" | ".join(rule["reason"] for bit, rule in enumerate(rules) if pattern >> bit & 1) for pattern in patterns], dtype=object)
+    actions = np.array([" | ".join(rule["action"] for bit, rule in enumerate(rules) if pattern >> bit & 1) for pattern in patterns], dtype=object)
+    to_remove = grouped_data[selected].reset_index(drop=True)
+    to_remove["Reason"] = reasons[codes]
+    to_remove["Suggested Action"] = actions[codes]
+    return to_remove[REVIEW_COLUMNS]
@@ -1,16 +1,25 @@
 from urllib.parse import urlparse
 from datetime import date, timedelta
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import RunReportRequest, Filter, FilterExpression, Dimension, Metric
-from google.oauth2 import service_account
-import pandas as pd
-import openpyxl
-import re
-import requests
-from openpyxl.styles import Alignment
+from ga_reports import (
+    fetch_department_reports,
+    fetch_site_rows,
+    ga_response_cache,
+    partition_rows,
+)
+from ga_client import GAClientPool
+from daily_store import fetch_incremental_site_rows
+from ai_insights import SUMMARY_ENGINE, SUMMARY_ENGINES, ai_summary_cache, get_ai_insights, get_summary_engine
+from local_summary import local_summary
+from ai_batch import AI_BATCH_SIZE, SummaryBatcher
+from department_report import InlineRenderer, normalize_path, process_single_department
+from render_pool import get_render_pool
+from output_sinks import OUTPUT_FORMAT, available_sinks, get_sink
+from async_pipeline import process_departments_async
 from dotenv import load_dotenv
 
+import multiprocessing
 import sys
+import asyncio
 import os
 
 # Load environment variables
@@ -25,18 +34,6 @@ def resource_path(rel_path):
         base_path = os.path.abspath(os.path.dirname(__file__))
     return os.path.join(base_path, rel_path)
 
-def normalize_path(path):
-    path = re.sub(r'//+', '/', path)
-    path = re.sub(r'(\/)?index\.html$', '', path, flags=re.IGNORECASE)
-    if not path.endswith('/'):
-        path += '/'
-    return path
-
-def clean_page_title(title):
-    if ' - ' in title:
-        return title.split(' - ', 1)[0].strip()
-    return title.strip()
-
 def get_user_input():
     """Get user input for URLs and file naming preferences"""
     print("=== PAGE INVENTORY TOOL ===\n")
@@ -70,6 +67,38 @@ def get_user_input():
     else:
         return urls, "custom"
 
+def get_output_format():
+    """Ask for the report file format, defaulting to OUTPUT_FORMAT"""
+    sinks = available_sinks()
+    names = list(sinks)
+    print("\nOutput formats:")
+    for number, sink in enumerate(sinks.values(), start=1):
+        print(f"{number}. {sink.label} ({sink.extension})")
+    
+    while True:
+        choice = input(f"Choose format (1-{len(names)}, or press Enter for {OUTPUT_FORMAT}): ").strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(names):
+            choice = names[int(choice) - 1]
+        try:
+            return get_sink(choice or None)
+        except ValueError as e:
+            print(e)
+
+def get_summary_engine_choice():
+    """Ask whether Gemini or the offline engine writes the Summary sheet, defaulting to SUMMARY_ENGINE"""
+    print("\nSummary engines:")
+    print("1. Gemini AI (needs GEMINI_API_KEY, falls back to local)")
+    print("2. Local (offline, instant)")
+    
+    while True:
+        choice = input(f"Choose engine (1-{len(SUMMARY_ENGINES)}, or press Enter for {SUMMARY_ENGINE}): ").strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(SUMMARY_ENGINES):
+            choice = SUMMARY_ENGINES[int(choice) - 1]
+        try:
+            return get_summary_engine(choice or None)
+        except ValueError as e:
+            print(e)
+
 def generate_filename(url, naming_mode, custom_names=None):
     """Generate filename based on URL and naming preference"""
     parsed_url = urlparse(url)
@@ -85,351 +114,29 @@ def generate_filename(url, naming_mode, custom_names=None):
     else:
         return f"{dept_name}_analytics.xlsx"
 
-def fetch_analytics_data(client, dept_path, start_date, end_date, property_id):
-    """Fetch analytics data for a department"""
-    request = RunReportRequest(
-        property="properties/" + property_id,
-        dimensions=[
-            Dimension(name="pagePath"),
-            Dimension(name="pageTitle")
-        ],
-        metrics=[
-            Metric(name="screenPageViews"),
-            Metric(name="activeUsers"),
-            Metric(name="userEngagementDuration"),
-            Metric(name="bounceRate"),
-            Metric(name="eventCount"),
-        ],
-        date_ranges=[{"start_date": start_date, "end_date": end_date}],
-        dimension_filter=FilterExpression(
-            filter=Filter(
-                field_name="pagePath",
-                string_filter={"value": dept_path, "match_type": "BEGINS_WITH"}
-            )
-        ),
-    )
-    
-    return client.run_report(request)
-
-def process_analytics_data(resp, base_url):
-    """Process raw analytics data into structured format"""
-    data = []
-    for idx in range(len(resp.rows)):
-        row = resp.rows[idx]
-        try:
-            raw_path = row.dimension_values[0].value
-            norm_path = normalize_path(raw_path)
-            title = clean_page_title(row.dimension_values[1].value)
-            pageviews = int(row.metric_values[0].value) if row.metric_values[0].value != "" else 0
-            users = int(row.metric_values[1].value) if row.metric_values[1].value != "" else 0
-            engagement_time = float(row.metric_values[2].value) if row.metric_values[2].value not in ["", None] else 0.0
-            bounce_rate_raw = float(row.metric_values[3].value) if row.metric_values[3].value not in ["", None] else 0.0
-            bounce_rate = bounce_rate_raw * 100
-            event_count = int(row.metric_values[4].value) if row.metric_values[4].value != "" else 0
-            link = base_url + norm_path
-
-            data.append({
-                "Page Title": title,
-                "URL": link,
-                "Normalized Path": norm_path,
-                "Views": pageviews,
-                "Users": users,
-                "Engagement Time (sec)": round(engagement_time, 2),
-                "Bounce Rate (%)": bounce_rate,
-                "Event Count": event_count,
-            })
-        except Exception as e:
-            print(f"Error in row processing: {e}")
-    
-    return data
-
-def analyze_pages(grouped_data):
-    """Analyze pages and create top 20 and pages to review lists"""
-    # Create top 20 pages
-    top_20 = grouped_data.sort_values(by="Views", ascending=False)
-    if len(top_20) > 20:
-        top_20 = top_20.head(20)
-    
-    # Identify pages to review
-    pages_to_review_data = []
-    for index, row in grouped_data.iterrows():
-        reasons = []
-        actions = []
-
-        # Get thresholds from environment variables or use defaults
-        low_views_threshold = int(os.getenv('LOW_VIEWS_THRESHOLD', '25'))
-        high_bounce_threshold = float(os.getenv('HIGH_BOUNCE_RATE_THRESHOLD', '45.0'))
-        long_engagement_threshold = float(os.getenv('LONG_ENGAGEMENT_THRESHOLD', '60.0'))
-        
-        # Condition 1: Low Page-views
-        if row["Views"] <= low_views_threshold:
-            reasons.append("Low page-views")
-            actions.append("Remove the page if it's no longer needed, or • Improve its visibility: add links from high-traffic pages or menus.")
+def process_department(url, client, start_date, end_date, targets, property_id, **options):
+    """Process a single department URL and print the outcome.
 
-        # Condition 2: High Bounce Rate
-        if row["Bounce Rate (%)"] >= high_bounce_threshold:
-            reasons.append("High bounce rate")
-            actions.append("Strengthen the \"first impression\": refine the page title, intro sentence, and hero image so they immediately match user intent.")
-
-        # Condition 3: Long Engagement Time Per View
-        if row["Engagement Time Per View"] > long_engagement_threshold:
-            reasons.append("Avg. engagement > 60 s")
-            actions.append("Tighten the page: focus on one topic, trim long sections, add clear sub-heads and bullets for quicker scanning.")
-
-        if reasons:
-            page_data = row.to_dict()
-            page_data["Reason"] = " | ".join(reasons)
-            page_data["Suggested Action"] = " | ".join(actions)
-            pages_to_review_data.append(page_data)
-
-    to_remove = pd.DataFrame(pages_to_review_data)
-    if not to_remove.empty:
-        review_columns = ["Page Title", "URL", "Reason", "Suggested Action", "Views", "Users", "Bounce Rate (%)", "Engagement Time Per View", "Event Count", "Views per User"]
-        to_remove = to_remove[review_columns]
-    
-    return top_20, to_remove
-
-def get_ai_insights(grouped_data, section_traffic_percentage, overall_stats):
-    """Get AI-generated insights using Gemini API"""
-    instructions = (
-        "INSTRUCTIONS:\n"
-        "- 'Top 20 Pages' tab: Most visited pages in this department.\n"
-        "- 'Pages to Review' tab: Pages with low or poor engagement; consider reviewing for updates, consolidation, or removal.\n"
-        "- 'All Pages' tab: Full analytics for every tracked page in this department.\n"
-        "- 'Summary' tab: Automated high-level advice for improving your section.\n"
-    )
-
-    formatted_summary = (
-        f"{instructions}\n"
-        f"SECTION TRAFFIC PERCENTAGE:\n"
-        f"- This department/section accounts for {section_traffic_percentage}% of all tracked site traffic.\n\n"
-        f"SUMMARY STATISTICS:\n"
-        f"- Total pages: {overall_stats['total_pages']}\n"
-        f"- Total views: {overall_stats['total_views']}\n"
-        f"- Average views per page: {overall_stats['average_views']:.2f}\n"
-        f"- Average users per page: {overall_stats['average_users']:.2f}\n"
-        f"- Average engagement time per view (sec): {overall_stats['average_engagement_time_per_view']:.2f}\n"
-        f"- Average bounce rate: {overall_stats['average_bounce_rate']:.2f}%\n"
-        f"- Pages with high bounce rate (>80%): {overall_stats['pages_with_high_bounce']}\n"
-        f"- Pages with low views (<10): {overall_stats['pages_with_low_views']}\n\n"
-        f"Top 5 most viewed pages:\n"
-    )
-    for page in overall_stats["top_5_pages"]:
-        formatted_summary += f"    - {page['Page Title']} ({page['Views']} views)\n"
-    formatted_summary += "Bottom 5 least viewed pages:\n"
-    for page in overall_stats["bottom_5_pages"]:
-        formatted_summary += f"    - {page['Page Title']} ({page['Views']} views)\n"
-
-    # Clean up formatting
-    formatted_summary = formatted_summary.replace("**", "")
-    formatted_summary = re.sub(r"#+\s*", "", formatted_summary)
-    
-    prompt = (
-        formatted_summary +
-        "\nBased on this data, provide a very specific summary of what is working well and what is not, "
-        "included any key trends or issues. Make your analysis and recommendations by using BOTH the page titles and all available analytics fields: views, users, bounce rate, event count, views per user, and engagement time per view (in seconds). "
-        "For each observation, clearly explain WHY you think a particular type of content or topic is performing well or underperforming, making logical inferences from both the title and the analytics. "
-        "The recommendations need to be meaningful and actionable for people with varying degrees of website knowledge and front end development skill. "
-        "Do not make row-by-row suggestions. Instead, group your analysis and recommendations by content themes, patterns, or page types (not individual pages). "
-        "Structure your response under these headings:\n"
-        "WHAT'S WORKING\n"
-        "WHAT'S NOT WORKING\n"
-        "RECOMMENDATIONS\n"
-        "Make your analysis as specific and actionable as possible based only on the titles and analytics provided."
-    )
-
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
-        print("Warning: GEMINI_API_KEY not found in environment variables. AI insights will be disabled.")
-        return "AI insights disabled: GEMINI_API_KEY not configured. Please set the GEMINI_API_KEY environment variable."
-    
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-    payload = {
-        "contents": [
-            {"parts": [{"text": prompt}]}
-        ]
-    }
-
-    try:
-        response = requests.post(url, json=payload, timeout=60)
-        if response.status_code == 200:
-            res_json = response.json()
-            try:
-                gemini_reply = res_json["candidates"][0]["content"]["parts"][0]["text"]
-            except Exception as nested_e:
-                print("Could not extract text from Gemini API:", nested_e)
-                gemini_reply = "Failed to parse Gemini API output."
-        else:
-            print("Gemini API error:", response.status_code, response.text)
-            gemini_reply = "API error: " + str(response.status_code)
-    except Exception as e:
-        gemini_reply = "Error retrieving Gemini suggestions: " + str(e)
-
-    # Clean up Gemini output
-    gemini_reply = gemini_reply.replace("**", "")
-    gemini_reply = re.sub(r"#+\s*", "", gemini_reply)
-    
-    return gemini_reply
-
-def format_excel_file(filename, top_20, to_remove, grouped_data, ai_summary):
-    """Create and format the Excel file with all sheets"""
-    try:
-        # Write data to Excel
-        writer = pd.ExcelWriter(filename, engine='openpyxl')
-        top_20.to_excel(writer, sheet_name='Top 20 Pages', index=False)
-        to_remove.to_excel(writer, sheet_name='Pages to Review', index=False)
-        grouped_data.to_excel(writer, sheet_name='All Pages', index=False)
-        writer.close()
-        
-        # Add AI summary
-        df_gemini = pd.DataFrame([{"Summary": ai_summary}])
-        writer2 = pd.ExcelWriter(filename, engine="openpyxl", mode="a", if_sheet_exists="replace")
-        df_gemini.to_excel(writer2, sheet_name="Summary", index=False)
-        writer2.close()
-        
-        # Format the Excel file
-        wb = openpyxl.load_workbook(filename)
-        
-        # Move Summary sheet to first position
-        ws_summary = wb["Summary"]
-        wb._sheets.remove(ws_summary)
-        wb._sheets.insert(0, ws_summary)
-        ws = ws_summary
-        ws.column_dimensions['A'].width = 120
-        if ws.max_row > 1:
-            cell = ws['A2']
-            cell.alignment = Alignment(wrap_text=True, vertical='top')
-        
-        # Auto-fit all sheets
-        for ws in wb.worksheets:
-            for col in ws.columns:
-                max_length = 0
-                col = list(col)
-                for cell in col:
-                    try:
-                        if cell.value is not None:
-                            max_length = max(max_length, len(str(cell.value)))
-                    except:
-                        pass
-                col_letter = col[0].column_letter
-                ws.column_dimensions[col_letter].width = max_length + 2
-            # Wrap text for headers
-            for cell in ws[1]:
-                cell.alignment = Alignment(wrap_text=True, vertical='top')
-        
-        wb.save(filename)
-        return True
-    except Exception as e:
-        print(f"Error formatting Excel file {filename}: {e}")
-        return False
-
-def process_single_department(url, client, start_date, end_date, filename, property_id):
-    """Process a single department URL and generate its Excel file"""
+    Returns what the render pool handed back when the files went to it,
+    otherwise whether they were written.
+    """
     print(f"\nProcessing: {url}")
-    
-    try:
-        # Parse URL and get department path
-        parsed_url = urlparse(url)
-        dept_path = normalize_path(parsed_url.path)
-        base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
-        
-        print(f"Department path: {dept_path}")
-        
-        # Fetch analytics data
-        resp = fetch_analytics_data(client, dept_path, start_date, end_date, property_id)
-        
-        if not resp.rows:
-            print(f"No data found for {url}")
-            return False
-        
-        # Process the data
-        data = process_analytics_data(resp, base_url)
-        
-        if not data:
-            print(f"No valid data found for {url}")
-            return False
-        
-        # Create DataFrame and group data
-        df = pd.DataFrame(data)
-        agg_dict = {
-            "Page Title": "first",
-            "Views": "sum",
-            "Users": "sum",
-            "Engagement Time (sec)": "sum",
-            "Bounce Rate (%)": "mean",
-            "Event Count": "sum"
-        }
-        
-        grouped = df.groupby(["Normalized Path", "URL"], as_index=False).agg(agg_dict)
-        
-        # Calculate derived metrics
-        grouped["Views per User"] = grouped.apply(
-            lambda row: round(row["Views"] / row["Users"], 2) if row["Users"] != 0 else 0, axis=1
-        )
-        grouped["Engagement Time Per View"] = grouped.apply(
-            lambda row: round(row["Engagement Time (sec)"] / row["Views"], 2) if row["Views"] != 0 else 0, axis=1
-        )
-        
-        # Clean up columns
-        if "Engagement Time (sec)" in grouped.columns:
-            grouped = grouped.drop(columns=["Engagement Time (sec)"])
-        if "Normalized Path" in grouped.columns:
-            grouped = grouped.drop(columns=["Normalized Path"])
-        
-        # Remove error pages
-        grouped = grouped[grouped["Page Title"] != "Oops! We can't seem to find that page."]
-        
-        # Analyze pages
-        top_20, to_remove = analyze_pages(grouped)
-        
-        # Get total site views for percentage calculation
-        request_total = RunReportRequest(
-            property="properties/" + property_id,
-            metrics=[Metric(name="screenPageViews")],
-            date_ranges=[{"start_date": start_date, "end_date": end_date}]
-        )
-        resp_total = client.run_report(request_total)
-        total_site_views = int(resp_total.rows[0].metric_values[0].value) if resp_total.rows else 0
-        
-        section_views = grouped["Views"].sum()
-        section_traffic_percentage = round((section_views / total_site_views) * 100, 2) if total_site_views > 0 else 0.0
-        
-        # Calculate overall statistics
-        overall_stats = {
-            "total_pages": len(grouped),
-            "total_views": grouped["Views"].sum(),
-            "average_views": grouped["Views"].mean(),
-            "average_users": grouped["Users"].mean(),
-            "average_engagement_time_per_view": grouped["Engagement Time Per View"].mean(),
-            "average_bounce_rate": grouped["Bounce Rate (%)"].mean(),
-            "pages_with_high_bounce": grouped[grouped["Bounce Rate (%)"] > 80].shape[0],
-            "pages_with_low_views": grouped[grouped["Views"] < 10].shape[0],
-            "top_5_pages": grouped.sort_values(by="Views", ascending=False).head(5)[["Page Title", "Views"]].to_dict('records'),
-            "bottom_5_pages": grouped.sort_values(by="Views", ascending=True).head(5)[["Page Title", "Views"]].to_dict('records'),
-        }
-        
-        # Get AI insights
-        ai_summary = get_ai_insights(grouped, section_traffic_percentage, overall_stats)
-        
-        # Create Excel file
-        success = format_excel_file(filename, top_20, to_remove, grouped, ai_summary)
-        
-        if success:
-            print(f"✓ Successfully created: {filename}")
-            return True
-        else:
-            print(f"✗ Failed to create: {filename}")
-            return False
-            
-    except Exception as e:
-        print(f"✗ Error processing {url}: {e}")
+    result = process_single_department(url, client, start_date, end_date, targets, property_id, **options)
+    if not result["success"]:
+        print(f"✗ {result['error']}")
         return False
+    if result["render"] is not None:
+        return result["render"]
+    print(f"✓ Successfully created: {', '.join(targets)}")
+    return True
 
 def main():
     """Main function to run the batch processing"""
     # Configuration
     PROPERTY_ID = os.getenv('GA_PROPERTY_ID', "319028439")
     KEY_PATH = resource_path(os.getenv('CREDENTIALS_PATH', "credentials.json"))
+    FETCH_MODE = os.getenv('FETCH_MODE', 'department')
+    ASYNC_PIPELINE = os.getenv('ASYNC_PIPELINE', 'false').lower() == 'true'
     
     # Get user input
     urls_and_naming = get_user_input()
@@ -449,10 +156,14 @@ def main():
                     custom_name += '.xlsx'
                 custom_names[url] = custom_name
     
+    sink = get_output_format()
+    summary_engine = get_summary_engine_choice() if sink.needs_summary else SUMMARY_ENGINE
+    
     # Set up Google Analytics client
     try:
-        creds = service_account.Credentials.from_service_account_file(KEY_PATH)
-        client = BetaAnalyticsDataClient(credentials=creds)
+        ga_clients = GAClientPool(KEY_PATH)
+        client = ga_clients.client()
+        creds = ga_clients.credentials
     except Exception as e:
         print(f"Error setting up Google Analytics client: {e}")
         print("Make sure credentials.json is in the same directory as the script.")
@@ -465,17 +176,67 @@ def main():
     print(f"\nProcessing {len(urls)} departments...")
     print(f"Date range: {start_date} to {end_date}")
     
-    # Process each URL
-    successful_files = []
-    failed_urls = []
+    # Pre-fetch every department's rows: in site-wide mode fetch the whole property once and
+    # split rows by department locally, otherwise batch the per-department and site total reports
+    dept_paths = [normalize_path(urlparse(url).path) for url in urls]
+    dept_rows = None
+    total_site_views = None
+    if FETCH_MODE in ("site", "incremental"):
+        print("Fetching site-wide analytics data...")
+        try:
+            if FETCH_MODE == "incremental":
+                site_rows = fetch_incremental_site_rows(client, start_date, end_date, PROPERTY_ID, dept_paths=dept_paths)
+            else:
+                site_rows = fetch_site_rows(client, start_date, end_date, PROPERTY_ID)
+            dept_rows = partition_rows(site_rows, dept_paths)
+        except Exception as e:
+            print(f"Error fetching site-wide analytics data: {e}")
+            return
+    elif not ASYNC_PIPELINE:
+        try:
+            dept_rows, total_site_views = fetch_department_reports(client, dept_paths, start_date, end_date, PROPERTY_ID)
+        except Exception as e:
+            print(f"Batched report request failed, fetching departments individually: {e}")
     
-    for url in urls:
-        filename = generate_filename(url, naming_mode, custom_names)
+    # Process each URL, rendering report files in worker processes when there are several
+    filenames = [sink.filenames(generate_filename(url, naming_mode, custom_names)) for url in urls]
+    render_pool = get_render_pool() if len(urls) > 1 else None
+    # Summaries come from the local engine, or from Gemini with departments pending together sharing requests
+    if summary_engine == 'local':
+        summary_insights = local_summary
+    elif AI_BATCH_SIZE > 1 and len(urls) > 1:
+        summary_insights = SummaryBatcher(expected=len(urls))
+        # Without worker processes, write the reports once every summary has started so they share requests
+        render_pool = render_pool or InlineRenderer()
+    else:
+        summary_insights = None
+    if ASYNC_PIPELINE:
+        filename_for = dict(zip(urls, filenames))
         
-        if process_single_department(url, client, start_date, end_date, filename, PROPERTY_ID):
-            successful_files.append(filename)
-        else:
-            failed_urls.append(url)
+        def run_department(url, rows, total_site_views, ai_insights):
+            return process_department(url, client, start_date, end_date, filename_for[url], PROPERTY_ID,
+                                      rows=rows, total_site_views=total_site_views,
+                                      ai_insights=summary_insights or ai_insights, sink=sink, render_pool=render_pool)
+        
+        outcomes = asyncio.run(process_departments_async(
+            urls, dept_paths, run_department, creds, start_date, end_date, PROPERTY_ID,
+            dept_rows=dept_rows, total_site_views=total_site_views
+        ))
+    else:
+        outcomes = []
+        for url, dept_path, names in zip(urls, dept_paths, filenames):
+            rows = dept_rows[dept_path] if dept_rows is not None else None
+            outcomes.append(process_department(url, client, start_date, end_date, names, PROPERTY_ID,
+                                               rows=rows, total_site_views=total_site_views,
+                                               ai_insights=summary_insights or get_ai_insights, sink=sink,
+                                               render_pool=render_pool))
+    
+    if render_pool is not None:
+        outcomes = [outcome if isinstance(outcome, bool) else render_pool.collect(outcome, names, url)
+                    for url, outcome, names in zip(urls, outcomes, filenames)]
+    
+    successful_files = [name for names, ok in zip(filenames, outcomes) if ok for name in names]
+    failed_urls = [url for url, ok in zip(urls, outcomes) if not ok]
     
     # Summary
     print(f"\n=== PROCESSING COMPLETE ===")
@@ -492,7 +253,17 @@ def main():
         for url in failed_urls:
             print(f"  - {url}")
     
+    cache_stats = ga_response_cache.stats()
+    if cache_stats["enabled"]:
+        print(f"\nGA response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    
+    ai_cache_stats = ai_summary_cache.stats()
+    if ai_cache_stats["enabled"] and ai_cache_stats["hits"] + ai_cache_stats["stale_hits"]:
+        print(f"AI summary cache: {ai_cache_stats['hits'] + ai_cache_stats['stale_hits']} summaries reused")
+    
     input("\nPress Enter to exit.")
 
 if __name__ == "__main__":
+    # Lets render worker processes start when this runs as a frozen executable
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -114,6 +114,12 @@ document.addEventListener("DOMContentLoaded", function () {
     const namingMode = document.querySelector(
       'input[name="namingMode"]:checked'
     ).value;
+    const outputFormat = document.querySelector(
+      'input[name="outputFormat"]:checked'
+    ).value;
+    const summaryEngine = document.querySelector(
+      'input[name="summaryEngine"]:checked'
+    ).value;
     const customPrefixValue = customPrefix.value.trim();
     const customNames = {};
 
@@ -137,6 +143,8 @@ document.addEventListener("DOMContentLoaded", function () {
       namingMode: namingMode,
       customPrefix: customPrefixValue,
       customNames: customNames,
+      outputFormat: outputFormat,
+      summaryEngine: summaryEngine,
     };
 
     // Show progress
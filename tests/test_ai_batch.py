@@ -0,0 +1,129 @@
+import io
+import json
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from google.analytics.data_v1beta.types import DimensionValue, MetricValue, Row
+
+import ai_batch
+import ai_insights
+import render_pool
+from ai_batch import SummaryBatcher
+from ai_insights import summary_sheet
+from department_report import InlineRenderer, process_single_department
+from gemini_client import gemini_client
+from output_sinks import SINKS
+from render_pool import RenderPool
+
+
+def overall_stats(pages):
+    return {
+        "total_pages": pages,
+        "total_views": pages * 10,
+        "average_views": 10.0,
+        "average_users": 4.0,
+        "average_engagement_time_per_view": 30.0,
+        "average_bounce_rate": 50.0,
+        "pages_with_high_bounce": 0,
+        "pages_with_low_views": 0,
+        "top_5_pages": [],
+        "bottom_5_pages": [],
+    }
+
+
+def make_row(path, title, views):
+    return Row(
+        dimension_values=[DimensionValue(value=path), DimensionValue(value=title)],
+        metric_values=[MetricValue(value=str(value)) for value in (views, views // 2, views * 3, 0.5, views)],
+    )
+
+
+def reply(text):
+    return SimpleNamespace(status_code=200, json=lambda: {"candidates": [{"content": {"parts": [{"text": text}]}}]})
+
+
+@pytest.fixture
+def gemini_requests(monkeypatch):
+    """Prompts sent to Gemini; every batched reply is valid, so no department falls back to its own call"""
+    requests = []
+
+    def post(url, payload, deadline=None):
+        prompt = payload["contents"][0]["parts"][0]["text"]
+        requests.append(prompt)
+        ids = re.findall(r"^DEPARTMENT (D\d+):$", prompt, re.MULTILINE)
+        if not ids:
+            return reply("WHAT'S WORKING\nsingle")
+        return reply(json.dumps([
+            {"department": department_id, "whats_working": department_id, "whats_not_working": "-", "recommendations": "-"}
+            for department_id in ids
+        ]))
+
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(gemini_client, "post", post)
+    monkeypatch.setattr(ai_batch, "cached_summary", lambda api_key, prompt: None)
+    monkeypatch.setattr(ai_batch, "store_summary", lambda prompt, summary: None)
+    monkeypatch.setattr(ai_insights, "store_summary", lambda prompt, summary: None)
+    return requests
+
+
+@pytest.mark.parametrize("departments, batch_size", [(10, 4), (6, 3), (3, 5)])
+def test_departments_share_batched_requests(gemini_requests, departments, batch_size):
+    batcher = SummaryBatcher(expected=departments, batch_size=batch_size)
+    futures = [batcher.start(pd.DataFrame(), 10.0, overall_stats(pages)) for pages in range(1, departments + 1)]
+
+    summaries = [future.result(timeout=10) for future in futures]
+
+    assert len(gemini_requests) == math.ceil(departments / batch_size)
+    assert all(summary.startswith("WHAT'S WORKING") for summary in summaries)
+
+
+def test_render_pool_does_not_flush_batches_early(gemini_requests, monkeypatch):
+    # Threads stand in for worker processes; what matters is that submit() doesn't wait on the summary
+    monkeypatch.setattr(render_pool, "ProcessPoolExecutor", lambda max_workers, mp_context: ThreadPoolExecutor(max_workers))
+    pool = RenderPool(2)
+    batcher = SummaryBatcher(batch_size=3)
+    departments = 6
+
+    reports = []
+    for pages in range(1, departments + 1):
+        summary = batcher.start(pd.DataFrame(), 10.0, overall_stats(pages))
+        sheets = [("All Pages", pd.DataFrame({"Views": [pages]})), ("Summary", summary_sheet(summary))]
+        target = io.BytesIO()
+        reports.append((pool.submit(SINKS["xlsx"], [target], sheets), target))
+
+    try:
+        assert all(pool.collect(future, [target], "test") for future, target in reports)
+    finally:
+        pool.shutdown()
+
+    assert len(gemini_requests) == math.ceil(departments / 3)
+    for future, target in reports:
+        target.seek(0)
+        assert pd.read_excel(target, sheet_name="Summary")["Summary"][0].startswith("WHAT'S WORKING")
+
+
+def test_departments_share_batched_requests_without_render_pool(gemini_requests):
+    departments = 6
+    batcher = SummaryBatcher(expected=departments, batch_size=5)
+    renderer = InlineRenderer()
+
+    reports = []
+    for number in range(departments):
+        url = f"https://x.edu/dept{number}/"
+        rows = [make_row(f"/dept{number}/p{page}/", f"Page {page}", 10 * page + number) for page in range(1, 4)]
+        targets = [io.BytesIO()]
+        result = process_single_department(url, None, "2026-01-01", "today", targets, "123", rows=rows,
+                                           total_site_views=1000, ai_insights=batcher, sink=SINKS["xlsx"],
+                                           render_pool=renderer)
+        assert result["success"], result.get("error")
+        reports.append((result["render"], targets))
+
+    assert all(renderer.collect(render, targets, "test") for render, targets in reports)
+    assert len(gemini_requests) == math.ceil(departments / 5)
+    for _, targets in reports:
+        targets[0].seek(0)
+        assert pd.read_excel(targets[0], sheet_name="Summary")["Summary"][0].startswith("WHAT'S WORKING")
@@ -0,0 +1,38 @@
+import asyncio
+
+import async_pipeline
+from ai_insights import start_ai_insights
+from async_pipeline import process_departments_async
+
+
+class FakeGAClient:
+    def __init__(self, credentials):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def test_summaries_outlive_their_departments(monkeypatch):
+    async def slow_summary(grouped_data, section_traffic_percentage, overall_stats, http_client, deadline=None):
+        await asyncio.sleep(0.2)
+        assert not http_client.is_closed
+        return f"summary {section_traffic_percentage}"
+
+    monkeypatch.setattr(async_pipeline, "BetaAnalyticsDataAsyncClient", FakeGAClient)
+    monkeypatch.setattr(async_pipeline, "get_ai_insights_async", slow_summary)
+
+    def process_department(url, rows, total_site_views, ai_insights):
+        # Like a report handed to the render pool: the summary is only waited for by the caller
+        return start_ai_insights(ai_insights, None, rows, {})
+
+    urls = ["https://x.edu/a/", "https://x.edu/b/"]
+    futures = asyncio.run(process_departments_async(
+        urls, ["/a/", "/b/"], process_department, None, "2026-01-01", "today", "123",
+        dept_rows={"/a/": 1, "/b/": 2}, total_site_views=10
+    ))
+
+    assert [future.result(timeout=0) for future in futures] == ["summary 1", "summary 2"]
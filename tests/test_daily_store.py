@@ -0,0 +1,67 @@
+from google.analytics.data_v1beta.types import DimensionValue, MetricValue, Row
+
+import daily_store
+from daily_store import DailyPartitionStore, fetch_incremental_site_rows
+
+
+def make_row(dimensions, metrics):
+    return Row(
+        dimension_values=[DimensionValue(value=value) for value in dimensions],
+        metric_values=[MetricValue(value=str(value)) for value in metrics],
+    )
+
+
+def fake_reports(request):
+    """Daily partitions with the same 5 users on each of 3 days, and 7 distinct users over the window"""
+    if request.dimensions[0].name == "date":
+        return [
+            make_row([day, "/bio/a", "A"], [10, 5, 30.0, 4, 2, 12])
+            for day in ("20260101", "20260102", "20260103")
+        ]
+    return [make_row(["/bio/a", "A"], [7])]
+
+
+def test_incremental_rows_use_window_users(tmp_path, monkeypatch):
+    requests = []
+    monkeypatch.setattr(daily_store, "page_filter", lambda: None)
+    monkeypatch.setattr(daily_store, "run_report_paginated", lambda client, request: requests.append(request) or fake_reports(request))
+    store = DailyPartitionStore(str(tmp_path / "daily.sqlite3"))
+
+    rows = fetch_incremental_site_rows(None, "2026-01-01", "2026-01-03", "123", store=store)
+
+    assert len(rows) == 1
+    assert [value.value for value in rows[0].metric_values[:2]] == ["30", "7"]
+    assert [metric.name for metric in requests[-1].metrics] == ["activeUsers"]
+
+
+def test_pages_missing_from_window_users_keep_daily_sum(tmp_path):
+    store = DailyPartitionStore(str(tmp_path / "daily.sqlite3"))
+    days = [daily_store.date(2026, 1, 1), daily_store.date(2026, 1, 2)]
+    store.replace_days("123", days, [
+        make_row(["20260101", "/bio/a", "A"], [10, 5, 30.0, 4, 2, 12]),
+        make_row(["20260102", "/bio/a", "A"], [10, 5, 30.0, 4, 2, 12]),
+    ], fetched_on=days[-1])
+
+    rows = store.aggregate_rows("123", days[0], days[-1], users={})
+
+    assert rows[0].metric_values[1].value == "10"
+
+
+def prefixes(expression):
+    """BEGINS_WITH values anywhere in a filter expression"""
+    if expression.filter.string_filter.match_type == expression.filter.string_filter.MatchType.BEGINS_WITH:
+        return [expression.filter.string_filter.value]
+    group = expression.and_group.expressions or expression.or_group.expressions
+    return [value for child in group for value in prefixes(child)]
+
+
+def test_window_users_are_limited_to_requested_departments(tmp_path, monkeypatch):
+    requests = []
+    monkeypatch.setattr(daily_store, "run_report_paginated", lambda client, request: requests.append(request) or fake_reports(request))
+    store = DailyPartitionStore(str(tmp_path / "daily.sqlite3"))
+
+    fetch_incremental_site_rows(None, "2026-01-01", "2026-01-03", "123", store=store, dept_paths=["/bio/", "/phys/", "/bio/"])
+
+    daily_request, users_request = requests
+    assert prefixes(daily_request.dimension_filter) == []
+    assert prefixes(users_request.dimension_filter) == ["/bio/", "/phys/"]
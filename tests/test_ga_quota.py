@@ -0,0 +1,93 @@
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from ga_quota import QuotaExhausted, QuotaScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.day = date(2026, 1, 1)
+
+    def __call__(self):
+        return self.now
+
+    def today(self):
+        return self.day
+
+
+def property_quota(hourly_remaining, daily_remaining, consumed=10, concurrent_remaining=9):
+    return SimpleNamespace(
+        tokens_per_hour=SimpleNamespace(consumed=consumed, remaining=hourly_remaining),
+        tokens_per_day=SimpleNamespace(consumed=consumed, remaining=daily_remaining),
+        concurrent_requests=SimpleNamespace(consumed=1, remaining=concurrent_remaining),
+    )
+
+
+def make_scheduler(clock, **limits):
+    limits = {"tokens_per_hour": 40000, "tokens_per_day": 200000, "reserve": 500, **limits}
+    return QuotaScheduler(clock=clock, today=clock.today, **limits)
+
+
+def test_reported_quota_overwrites_local_estimate():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, tokens_per_day=1000)
+
+    # Local bookkeeping alone would run the daily budget down below the reserve
+    for _ in range(40):
+        cost = scheduler.acquire()
+        scheduler.release(cost, [property_quota(39990, 199990)])
+
+    assert scheduler.daily_tokens == 199990
+    assert scheduler.hourly_tokens == 39990
+    scheduler.release(scheduler.acquire())
+
+
+def test_reported_quota_accounts_for_requests_still_in_flight():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+
+    first = scheduler.acquire()
+    second = scheduler.acquire()
+    scheduler.release(first, [property_quota(30000, 150000)])
+
+    assert scheduler.hourly_tokens == 30000 - second
+    assert scheduler.daily_tokens == 150000 - second
+
+
+def test_daily_budget_refills_at_day_boundary():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    scheduler.release(scheduler.acquire(), [property_quota(39990, 400)])
+
+    with pytest.raises(QuotaExhausted):
+        scheduler.acquire()
+
+    clock.day += timedelta(days=1)
+    cost = scheduler.acquire()
+    assert scheduler.daily_tokens == 200000 - cost
+    scheduler.release(cost)
+
+
+def test_hourly_bucket_refills_over_time():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, tokens_per_hour=3600)
+    scheduler.release(scheduler.acquire(), [property_quota(0, 100000)])
+    assert scheduler.hourly_tokens == 0
+
+    clock.now += 1800
+    scheduler._refill()
+    assert scheduler.hourly_tokens == pytest.approx(1800)
+
+
+def test_concurrent_limit_follows_reported_allowance():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, concurrent_requests=10)
+
+    scheduler.release(scheduler.acquire(), [property_quota(39990, 199990, concurrent_remaining=2)])
+    assert scheduler.concurrent_limit == 3
+
+    scheduler.release(scheduler.acquire(), [property_quota(39990, 199990, concurrent_remaining=50)])
+    assert scheduler.concurrent_limit == 10
@@ -0,0 +1,14 @@
+import pytest
+
+from ranking import parse_top_pages
+
+
+@pytest.mark.parametrize("value, expected", [(20, 20), ("5", 5), (" 7 ", 7)])
+def test_parse_top_pages_accepts_positive_integers(value, expected):
+    assert parse_top_pages(value) == expected
+
+
+@pytest.mark.parametrize("value", [0, -5, "0", "-5", "abc", "", 2.5, True, None, "²"])
+def test_parse_top_pages_rejects_other_values(value):
+    with pytest.raises(ValueError):
+        parse_top_pages(value)
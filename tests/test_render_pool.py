@@ -0,0 +1,20 @@
+import io
+from concurrent.futures import Future
+
+from render_pool import RenderPool
+
+
+def test_collect_reports_failures_by_label(capsys):
+    pool = RenderPool(1)
+    render = Future()
+    render.cancel()
+
+    try:
+        assert not pool.collect(render, [io.BytesIO()], "https://x.edu/bio/")
+    finally:
+        pool.shutdown()
+
+    out = capsys.readouterr().out
+    assert "https://x.edu/bio/" in out
+    assert "CancelledError" in out
+    assert "BytesIO" not in out
@@ -0,0 +1,42 @@
+import io
+import zipfile
+
+from report_store import ReportStore, stream_zip
+
+
+def test_oldest_reports_are_dropped_over_byte_cap():
+    store = ReportStore(max_bytes=250)
+    first = store.put([("a.xlsx", b"x" * 100)])
+    second = store.put([("b.xlsx", b"x" * 100)])
+    third = store.put([("c.xlsx", b"x" * 100)])
+
+    assert store.get(first) is None
+    assert store.get(second) is not None
+    assert store.get(third) is not None
+    assert store.total_bytes == 200
+
+
+def test_newest_report_is_kept_even_if_over_byte_cap():
+    store = ReportStore(max_bytes=50)
+    store.put([("a.xlsx", b"x" * 10)])
+    token = store.put([("big.xlsx", b"x" * 100)])
+
+    assert store.get(token).files == [("big.xlsx", b"x" * 100)]
+    assert store.total_bytes == 100
+
+
+def test_entry_count_and_ttl_limits():
+    store = ReportStore(max_entries=2)
+    tokens = [store.put([(f"{n}.csv", b"data")]) for n in range(3)]
+    assert [store.get(token) is not None for token in tokens] == [False, True, True]
+
+    expired = ReportStore(ttl=-1)
+    assert expired.get(expired.put([("a.csv", b"data")])) is None
+    assert expired.total_bytes == 0
+
+
+def test_stream_zip_round_trips():
+    files = [("a.xlsx", b"x" * 1000), ("b.csv", b"y" * 200000)]
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(stream_zip(files, chunk_size=4096))))
+    assert [(name, archive.read(name)) for name in archive.namelist()] == files
+    assert archive.getinfo("a.xlsx").compress_type == zipfile.ZIP_STORED